@@ -1,5 +1,6 @@
 import os
 import sys
+import threading
 import sublime
 import sublime_plugin
 
@@ -7,11 +8,15 @@ import sublime_plugin
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 from php_coverage.command import CoverageCommand
 from php_coverage.config import config
+from php_coverage.data import CoverageDataFactory, LoadCancelled
 from php_coverage.debug import debug_message
 from php_coverage.helper import set_timeout_async, sublime3
 from php_coverage.mediator import ViewWatcherMediator
-from php_coverage.updater import ViewUpdater
-from php_coverage.watcher import FileWatcher
+from php_coverage.stats import stats
+from php_coverage.updater import ViewUpdater, applied
+from php_coverage.updates import queue
+from php_coverage.watcher import FileWatcher, stop_scheduler
+from php_coverage import worker
 
 
 mediator = ViewWatcherMediator({
@@ -31,12 +36,24 @@ def update_view(view, coverage=None):
     coverage data doesn't exist for the file shown in the view, or the
     coverage data is None, then the displayed coverage data will be
     removed from the view.
+
+    If the coverage data has been superseded by a newer version of the
+    coverage file, the view is left alone, as it will be (or already
+    has been) updated with the newer version.
     """
 
     filename = view.file_name()
-    debug_message('Updating coverage for ' + filename)
+    debug_message('Updating coverage for %s', filename)
+
+    try:
+        if coverage and coverage.is_cancelled():
+            raise LoadCancelled("Coverage data is out of date")
+
+        file_coverage = coverage.get_file(filename) if coverage else None
+    except LoadCancelled as e:
+        debug_message("Not updating %s: %s", filename, e)
+        return
 
-    file_coverage = coverage.get_file(filename) if coverage else None
     ViewUpdater().update(view, file_coverage)
 
 
@@ -50,18 +67,28 @@ def plugin_loaded():
 
     # add open views to the mediator
     for window in sublime.windows():
-        debug_message("[plugin_loaded] Found window %d" % window.id())
+        debug_message("[plugin_loaded] Found window %d", window.id())
         for view in window.views():
-            debug_message("[plugin_loaded] Found view %d" % view.id())
+            debug_message("[plugin_loaded] Found view %d", view.id())
             mediator.add(view)
-            set_timeout_async(
-                lambda: view.run_command('phpcoverage_update'),
-                1
+            queue.add(
+                view,
+                lambda view=view: view.run_command('phpcoverage_update')
             )
 
     debug_message("[plugin_loaded] Finished.")
 
 
+def plugin_unloaded():
+    """
+    Called automatically by Sublime when the plugin is unloaded.
+    Stops the watcher thread and worker process, so they don't outlive
+    the plugin.
+    """
+    stop_scheduler(1)
+    worker.shutdown()
+
+
 class NewFileEventListener(sublime_plugin.EventListener):
 
     """
@@ -86,10 +113,49 @@ class NewFileEventListener(sublime_plugin.EventListener):
         if not sublime3:
             self.on_load_async(view)
 
+    def on_activated_async(self, view):
+        """
+        Annotates newly visible lines of a view in viewport mode. There
+        is no event for scrolling, so this is also done whenever the
+        view is edited, or its selection changes.
+        """
+        if config.get('viewport_threshold') is not None:
+            ViewUpdater().refresh(view)
+
+    def on_selection_modified_async(self, view):
+        self.on_activated_async(view)
+
+    def on_modified_async(self, view):
+        self.on_activated_async(view)
+
+    def on_activated(self, view):
+        """
+        Synchronous fallback for on_activated_async() for Sublime 2
+        """
+        if not sublime3:
+            self.on_activated_async(view)
+
+    def on_selection_modified(self, view):
+        """
+        Synchronous fallback for on_selection_modified_async() for
+        Sublime 2
+        """
+        if not sublime3:
+            self.on_activated_async(view)
+
+    def on_modified(self, view):
+        """
+        Synchronous fallback for on_modified_async() for Sublime 2
+        """
+        if not sublime3:
+            self.on_activated_async(view)
+
     def on_close(self, view):
         """
         Unregister any listeners for the view that was just closed.
         """
+        queue.discard(view)
+        applied.forget(view)
         set_timeout_async(lambda: mediator.remove(view), 1)
 
 
@@ -106,7 +172,7 @@ class PhpcoverageUpdateCommand(CoverageCommand, sublime_plugin.TextCommand):
             return
 
         if not self.should_include(filename):
-            debug_message("Ignoring excluded file '%s'" % filename)
+            debug_message("Ignoring excluded file '%s'", filename)
             return
 
         if not coverage:
@@ -119,16 +185,70 @@ class PhpcoverageUpdateAllCommand(CoverageCommand, sublime_plugin.TextCommand):
 
     """
     Updates the code coverage data for files in all open views.
+
+    Views are grouped by their coverage file, so that each coverage
+    file is only found and loaded once. Distinct coverage files are
+    loaded in parallel, each in a thread of its own.
     """
 
     def run(self, edit):
         windows = sublime.windows() or []
+        views = []
 
         for window in windows:
-            views = window.views() or []
+            views.extend(window.views() or [])
+
+        for coverage_file, views in self.group_views(views).items():
+            thread = threading.Thread(
+                target=self.update_views,
+                args=(coverage_file, views),
+            )
+            thread.daemon = True
+            thread.start()
+
+    def update_views(self, coverage_file, views):
+        """
+        Loads a coverage file, then updates the coverage data displayed
+        in each of the views whose coverage data it contains.
+        """
+        coverage = None
+
+        if coverage_file:
+            coverage = CoverageDataFactory().factory(coverage_file)
+
+            try:
+                coverage.ensure_loaded()
+            except LoadCancelled as e:
+                debug_message("Not updating views: %s", e)
+                return
+
+        for view in views:
+            queue.add(view, lambda view=view: update_view(view, coverage))
+
+
+class PhpcoverageStatsCommand(sublime_plugin.WindowCommand):
+
+    """
+    Shows how long the plugin's operations have been taking, in an
+    output panel and the console. Statistics are only collected while
+    the "stats" setting is enabled.
+    """
+
+    def run(self, clear=False):
+        if clear:
+            stats.clear()
+
+        text = '\n'.join(stats.summary()) + '\n'
+        print(text)
+
+        if hasattr(self.window, 'create_output_panel'):
+            panel = self.window.create_output_panel('phpcoverage_stats')
+        else:
+            panel = self.window.get_output_panel('phpcoverage_stats')
 
-            for view in views:
-                view.run_command("phpcoverage_update")
+        panel.run_command('append', {'characters': text})
+        self.window.run_command(
+            'show_panel', {'panel': 'output.phpcoverage_stats'})
 
 
 if not sublime3:
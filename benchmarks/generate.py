@@ -0,0 +1,101 @@
+import argparse
+import os
+import random
+
+
+def generate(filename, files=100, lines=500, hit_ratio=0.7,
+             statement_ratio=0.5, root='/src', seed=0):
+    """
+    Writes a synthetic Clover coverage file, in the same shape as the
+    ones written by PHPUnit.
+
+    Each of the files in the report has the given number of lines, of
+    which roughly statement_ratio are statements, and roughly hit_ratio
+    of those are covered by at least one test. Returns a list of the
+    names of the source files in the report.
+    """
+    rng = random.Random(seed)
+    names = []
+
+    with open(filename, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<coverage generated="1370000000">\n')
+        f.write('  <project timestamp="1370000000">\n')
+
+        for index in range(files):
+            package = 'Package%d' % (index // 50)
+            name = os.path.join(root, package, 'Class%d.php' % index)
+            names.append(name)
+
+            if index % 50 == 0:
+                if index:
+                    f.write('    </package>\n')
+                f.write('    <package name="%s">\n' % package)
+
+            write_file(f, name, lines, hit_ratio, statement_ratio, rng)
+
+        if files:
+            f.write('    </package>\n')
+
+        f.write('    <metrics files="%d" loc="%d"/>\n' % (
+            files, files * lines))
+        f.write('  </project>\n')
+        f.write('</coverage>\n')
+
+    return names
+
+
+def write_file(f, name, lines, hit_ratio, statement_ratio, rng):
+    """
+    Writes a single <file> element to a synthetic coverage file.
+    """
+    statements = []
+    for line in range(3, lines + 1):
+        if rng.random() < statement_ratio:
+            count = rng.randint(1, 20) if rng.random() < hit_ratio else 0
+            statements.append((line, count))
+
+    covered = len([s for s in statements if s[1] > 0])
+    class_name = os.path.splitext(os.path.basename(name))[0]
+
+    f.write('      <file name="%s">\n' % name)
+    f.write('        <class name="%s" namespace="global">\n' % class_name)
+    f.write('          <metrics methods="1" coveredmethods="0" '
+            'conditionals="0" coveredconditionals="0" '
+            'statements="%d" coveredstatements="%d" '
+            'elements="%d" coveredelements="%d"/>\n' % (
+                len(statements), covered, len(statements) + 1, covered))
+    f.write('        </class>\n')
+    f.write('        <line num="2" type="method" name="run" '
+            'crap="1" count="1"/>\n')
+
+    for line, count in statements:
+        f.write('        <line num="%d" type="stmt" count="%d"/>\n' % (
+            line, count))
+
+    f.write('        <metrics loc="%d" ncloc="%d" classes="1" methods="1" '
+            'coveredmethods="0" conditionals="0" coveredconditionals="0" '
+            'statements="%d" coveredstatements="%d" elements="%d" '
+            'coveredelements="%d"/>\n' % (
+                lines, lines, len(statements), covered,
+                len(statements) + 1, covered))
+    f.write('      </file>\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic Clover coverage file")
+    parser.add_argument('output', help="file to write the report to")
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--lines', type=int, default=500)
+    parser.add_argument('--hit-ratio', type=float, default=0.7)
+    parser.add_argument('--statement-ratio', type=float, default=0.5)
+    parser.add_argument('--root', default='/src')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.output, args.files, args.lines, args.hit_ratio,
+             args.statement_ratio, args.root, args.seed)
+
+if __name__ == '__main__':
+    main()
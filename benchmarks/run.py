@@ -0,0 +1,390 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generate import generate
+from tests import fake
+
+fake.install()
+
+from php_coverage.config import config
+from php_coverage.data import CoverageData, FileCoverage, fingerprint
+from php_coverage.data import IndexedCoverageData, ScanningCoverageData
+from php_coverage.data import StreamingCoverageData
+from php_coverage.finder import CoverageFinder, FinderCache
+from php_coverage.matcher import Matcher, MatcherCache
+from php_coverage.updater import AppliedCoverage, ViewUpdater
+from php_coverage.watcher import FileWatcher
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+LOADERS = [
+    ('tree', CoverageData),
+    ('stream', StreamingCoverageData),
+    ('scan', ScanningCoverageData),
+    ('index', IndexedCoverageData),
+]
+
+
+def measure(function, setup=None, repeat=5, items=1):
+    """
+    Times a function, returning a dictionary of results. The function
+    is passed the result of calling setup (if given) before each run,
+    which isn't included in the timing.
+
+    Peak memory is measured in a separate run using tracemalloc, so
+    tracing doesn't slow down the timed runs. It's None if tracemalloc
+    isn't available.
+    """
+    times = []
+
+    for _ in range(repeat):
+        state = setup() if setup else None
+        gc.collect()
+        start = timer()
+        function(state)
+        times.append(timer() - start)
+
+    best = min(times)
+    return {
+        'best': best,
+        'mean': sum(times) / len(times),
+        'repeat': repeat,
+        'items': items,
+        'per_second': items / best if best else None,
+        'peak_memory': peak_memory(function, setup),
+    }
+
+
+def peak_memory(function, setup=None):
+    """
+    Measures the peak memory allocated while running a function, in
+    bytes.
+    """
+    if tracemalloc is None:
+        return None
+
+    state = setup() if setup else None
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        function(state)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class Benchmarks():
+
+    """
+    Benchmarks the plugin's hot paths against a synthetic coverage
+    file, generated in a temporary directory laid out like a project.
+    """
+
+    def __init__(self, files, lines, hit_ratio, repeat):
+        self.files = files
+        self.lines = lines
+        self.hit_ratio = hit_ratio
+        self.repeat = repeat
+        self.results = {}
+
+    def setup(self):
+        """
+        Generates the coverage file, and configures the plugin.
+        """
+        self.dir = tempfile.mkdtemp()
+        logs = os.path.join(self.dir, 'build', 'logs')
+        os.makedirs(logs)
+
+        self.report = os.path.join(logs, 'clover.xml')
+        self.names = generate(
+            self.report,
+            files=self.files,
+            lines=self.lines,
+            hit_ratio=self.hit_ratio,
+            root=os.path.join(self.dir, 'src'),
+        )
+
+        config.loaded = True
+        config.debug = False
+        config.report_path = 'build/logs/clover.xml'
+        config.include = ['\\.php$']
+        config.exclude = ['[/\\\\]tests?[/\\\\].*']
+        config.settle_time = 0
+        config.full_hash = False
+
+        # every parsed file, to count lines and annotate views with
+        data = CoverageData(self.report)
+        self.coverage = [data.get_file(name) for name in self.names]
+        self.statements = sum(c.statements for c in self.coverage)
+
+    def teardown(self):
+        """
+        Removes the coverage file, and resets the plugin configuration.
+        """
+        shutil.rmtree(self.dir)
+        config.loaded = False
+
+    def add(self, name, function, setup=None, items=1, **extra):
+        """
+        Runs a benchmark and stores its results.
+        """
+        result = measure(function, setup, self.repeat, items)
+        result.update(extra)
+        self.results[name] = result
+        report(name, result)
+
+    def run(self, only=None):
+        """
+        Runs all of the benchmarks whose name contains only (or all of
+        them if only is None), returning their results.
+        """
+        self.setup()
+
+        try:
+            for name in sorted(dir(self)):
+                if not name.startswith('bench_'):
+                    continue
+
+                if only and only not in name:
+                    continue
+
+                getattr(self, name)()
+        finally:
+            self.teardown()
+
+        return self.results
+
+    def bench_load(self):
+        for name, class_name in LOADERS:
+            self.add(
+                'load.%s' % name,
+                lambda data: data.load(),
+                lambda: class_name(self.report),
+                items=self.files,
+            )
+
+    def bench_get_file(self):
+        for name, class_name in LOADERS:
+            def setup():
+                data = class_name(self.report)
+                data.load()
+                return data
+
+            self.add(
+                'get_file.%s' % name,
+                lambda data: [data.get_file(n) for n in self.names],
+                setup,
+                items=self.files,
+            )
+
+    def bench_parse(self):
+        def setup():
+            data = CoverageData(self.report)
+            data.load()
+            return [FileCoverage(n, d) for n, d in data.entries()]
+
+        def parse(coverage):
+            for file_coverage in coverage:
+                file_coverage.parse()
+
+        self.add('parse', parse, setup, items=self.statements)
+
+    def bench_finder(self):
+        def find(finder):
+            for name in self.names:
+                finder.find(name)
+
+        self.add(
+            'finder.cold',
+            find,
+            lambda: CoverageFinder(FinderCache()),
+            items=self.files,
+        )
+
+        warm = CoverageFinder(FinderCache())
+        find(warm)
+        self.add('finder.warm', find, lambda: warm, items=self.files)
+
+    def bench_matcher(self):
+        def match(matcher):
+            for name in self.names:
+                matcher.should_include(name)
+
+        self.add(
+            'matcher.cold',
+            match,
+            lambda: Matcher(MatcherCache()),
+            items=self.files,
+        )
+
+        warm = Matcher(MatcherCache())
+        match(warm)
+        self.add('matcher.warm', match, lambda: warm, items=self.files)
+
+    def bench_watcher(self):
+        watcher = FileWatcher(self.report)
+        size = os.path.getsize(self.report)
+
+        self.add('watcher.hash', lambda _: watcher.hash(), items=size)
+        self.add(
+            'watcher.digest',
+            lambda _: watcher.digest(fingerprint(self.report)),
+            items=size,
+        )
+
+        def poll(_):
+            for _ in range(1000):
+                watcher.poll()
+
+        watcher.reset()
+        self.add('watcher.poll', poll, items=1000)
+
+    def bench_annotate(self):
+        views = [fake.View(c.num_lines, id=i)
+                 for i, c in enumerate(self.coverage)]
+        lines = sum(len(c.good_lines) + len(c.bad_lines)
+                    for c in self.coverage)
+
+        def annotate(updater):
+            for view, coverage in zip(views, self.coverage):
+                updater.annotate_lines(
+                    view=view,
+                    name='SublimePHPCoverageGood',
+                    lines=coverage.good_lines,
+                    scope='markup.inserted',
+                    icon='dot',
+                )
+                updater.annotate_lines(
+                    view=view,
+                    name='SublimePHPCoverageBad',
+                    lines=coverage.bad_lines,
+                    scope='markup.deleted',
+                    icon='bookmark',
+                )
+
+        for view in views:
+            view.calls = 0
+        annotate(ViewUpdater())
+        calls = sum(view.calls for view in views)
+
+        self.add('annotate_lines', annotate, ViewUpdater, items=lines,
+                 api_calls=calls)
+
+        def update(updater):
+            for view, coverage in zip(views, self.coverage):
+                updater.update(view, coverage)
+
+        unchanged = ViewUpdater(AppliedCoverage())
+        update(unchanged)
+        self.add('update.unchanged', update, lambda: unchanged,
+                 items=self.files)
+
+
+def report(name, result):
+    """
+    Prints the results of a benchmark.
+    """
+    memory = result['peak_memory']
+    print('%-20s %10.2f ms %14.0f /s %12s' % (
+        name,
+        result['best'] * 1000,
+        result['per_second'] or 0,
+        '-' if memory is None else '%.1f KiB' % (memory / 1024.0),
+    ))
+
+
+def compare(results, baseline):
+    """
+    Prints the change in the best time of each benchmark compared to a
+    baseline set of results.
+    """
+    print('')
+    print('Compared with baseline (best time, lower is better):')
+
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+
+        before = baseline[name]['best']
+        after = results[name]['best']
+        change = (after - before) / before * 100 if before else 0
+        print('%-20s %10.2f ms -> %10.2f ms %+8.1f%%' % (
+            name, before * 1000, after * 1000, change))
+
+
+def commit():
+    """
+    Gets the current git commit, or None if it can't be found.
+    """
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return output.decode('ascii').strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark SublimePHPCoverage's hot paths")
+    parser.add_argument('--files', type=int, default=200,
+                        help="number of files in the coverage file")
+    parser.add_argument('--lines', type=int, default=500,
+                        help="number of lines in each file")
+    parser.add_argument('--hit-ratio', type=float, default=0.7,
+                        help="proportion of statements which are covered")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="number of times to run each benchmark")
+    parser.add_argument('--only',
+                        help="only run benchmarks containing this name")
+    parser.add_argument('--output', help="file to save results to, as JSON")
+    parser.add_argument('--compare',
+                        help="JSON results file to compare the results with")
+    args = parser.parse_args()
+
+    benchmarks = Benchmarks(args.files, args.lines, args.hit_ratio,
+                            args.repeat)
+    results = benchmarks.run(args.only)
+
+    output = {
+        'meta': {
+            'commit': commit(),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'time': time.time(),
+            'files': args.files,
+            'lines': args.lines,
+            'hit_ratio': args.hit_ratio,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+if __name__ == '__main__':
+    main()
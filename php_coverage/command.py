@@ -1,3 +1,4 @@
+import collections
 import sublime_plugin
 
 from php_coverage.data import CoverageDataFactory
@@ -53,3 +54,28 @@ class CoverageCommand(sublime_plugin.TextCommand):
         Determines whether a file should be included or not.
         """
         return self.get_matcher().should_include(filename)
+
+    def group_views(self, views):
+        """
+        Groups views by the coverage file containing the coverage data
+        for the file open in each view, so each coverage file only
+        needs to be found and loaded once.
+
+        Returns an OrderedDict mapping each coverage file to a list of
+        its views. Views whose coverage file can't be found are grouped
+        under None. Views without a file, or with an excluded file, are
+        left out.
+        """
+        groups = collections.OrderedDict()
+        finder = self.get_coverage_finder()
+
+        for view in views:
+            filename = view.file_name()
+
+            if filename is None or not self.should_include(filename):
+                continue
+
+            coverage_file = finder.find(filename)
+            groups.setdefault(coverage_file, []).append(view)
+
+        return groups
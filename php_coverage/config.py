@@ -11,12 +11,26 @@ class Config():
         "debug",
         "report_path",
         "watch_report",
+        "watch_backend",
+        "settle_time",
+        "poll_interval",
+        "max_poll_interval",
+        "full_hash",
         "include",
         "exclude",
+        "loader",
+        "cache_size",
+        "process_threshold",
+        "viewport_threshold",
+        "viewport_margin",
+        "snapshot",
+        "snapshot_dir",
+        "stats",
     ]
 
     def __init__(self):
         self.loaded = False
+        self.listeners = []
 
     def load(self):
         """
@@ -48,23 +62,46 @@ class Config():
 
         self.loaded = True
 
+        for listener in self.listeners:
+            listener()
+
+    def add_listener(self, listener):
+        """
+        Adds a function to be called (without arguments) every time the
+        settings are loaded, so cached values derived from the settings
+        can be discarded.
+        """
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
     def is_loaded(self):
         """
         Determines whether or not the settings have been loaded.
         """
         return self.loaded
 
+    def get(self, key, default=None):
+        """
+        Gets a loaded configuration value by key, falling back to a
+        default if the configuration isn't loaded or the value is unset.
+        """
+        if not self.is_loaded():
+            return default
+
+        value = self.__dict__.get(key, None)
+        return default if value is None else value
+
     def get_setting(self, key):
         """
         Gets a configuration value by key.
         """
         if key in self.project:
             value = self.project.get(key)
-            debug_message("[config] [project] %s: '%s'" % (key, value))
+            debug_message("[config] [project] %s: '%s'", key, value)
             return value
         else:
             value = self.settings.get(key, None)
-            debug_message("[config]: %s: '%s'" % (key, value))
+            debug_message("[config]: %s: '%s'", key, value)
             return value
 
     def __getattr__(self, key):
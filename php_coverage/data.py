@@ -1,17 +1,63 @@
+import array
+import collections
+import glob
+import hashlib
+import mmap
 import os
+import re
+import struct
+import threading
 import xml.etree.ElementTree
 
+from php_coverage import scanner
+from php_coverage import worker
+from php_coverage.config import config
+from php_coverage.debug import debug_message
+from php_coverage.finder import is_pattern
+from php_coverage.snapshot import LINE_TYPE, Snapshot, pack, unpack
+from php_coverage.stats import stats, timed
+
+# Errors raised when parsing malformed (or since rewritten) coverage data
+PARSE_ERRORS = (AttributeError, TypeError, ValueError,
+                xml.etree.ElementTree.ParseError)
+
+# A <file> start tag, whose quoted attribute values may contain ">"
+FILE_TAG = re.compile(br'<file(?=[\s/>])(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+
+# The start of the <project> element, which contains the <file> elements
+PROJECT_TAG = re.compile(br'<project(?=[\s/>])')
+
 
 class CoverageData():
 
     """
     Represents a coverage data file.
+
+    Coverage files larger than the "process_threshold" setting (in
+    megabytes) are parsed in a worker process, if possible, so parsing
+    doesn't hold up other threads in the plugin host.
+
+    Once a newer version of the coverage file has been seen, the data
+    is cancelled using cancel(). Any load in progress then stops as
+    soon as it can, raising LoadCancelled, and so does any later load.
     """
 
+    # whether the coverage file can be parsed in a worker process
+    process = True
+
+    # whether loading writes a snapshot, which parses every file
+    snapshots = True
+
     def __init__(self, coverage_file):
         self.coverage_file = coverage_file
         self.elements = None
+        self.summarised = False
         self.files = {}
+        self.index = None
+        self.resolved = None
+        self.normalised = {}
+        self.lock = threading.RLock()
+        self.cancelled = threading.Event()
 
     def is_loaded(self):
         """
@@ -19,31 +65,259 @@ class CoverageData():
         """
         return not self.elements is None
 
+    def cancel(self):
+        """
+        Marks the data as superseded by a newer version of the coverage
+        file, so any load in progress is abandoned.
+        """
+        self.cancelled.set()
+
+    def is_cancelled(self):
+        """
+        Determines whether the data has been superseded by a newer
+        version of the coverage file.
+        """
+        return self.cancelled.is_set()
+
+    def release(self):
+        """
+        Discards the loaded data once it has been superseded, so a
+        superseded version of a large coverage file doesn't stay in
+        memory. Only the FileCoverage objects already requested are
+        kept, which is all reuse() needs to compare with.
+        """
+        self.elements = None
+        self.index = None
+        self.resolved = None
+
+    def check_cancelled(self):
+        """
+        Raises LoadCancelled if the data has been cancelled. Readers
+        call this between <file> elements.
+        """
+        if self.is_cancelled():
+            raise LoadCancelled(
+                "Newer version of %s found" % self.coverage_file)
+
+    def ensure_loaded(self):
+        """
+        Loads the XML data from the coverage file, unless it's already
+        loaded.
+        """
+        if not self.is_loaded():
+            # data may be shared between threads, so only load once
+            with self.lock:
+                if not self.is_loaded():
+                    self.load()
+
+    @timed('data.load')
     def load(self):
         """
         Loads the XML data from the coverage file.
+
+        If snapshots are enabled, the data is read from a snapshot made
+        from the current version of the coverage file if one exists,
+        skipping XML parsing altogether. Otherwise, a snapshot is
+        written after parsing the XML data, unless self.snapshots is
+        unset.
+
+        Raises LoadCancelled if the data is cancelled before it's
+        completely loaded, leaving it unloaded.
         """
+        self.check_cancelled()
         self.files = {}
-        if os.path.exists(self.coverage_file):
-            root = xml.etree.ElementTree.parse(self.coverage_file)
-            self.elements = root.findall('./project//file')
-        else:
+        self.summarised = False
+        state = fingerprint(self.coverage_file)
+
+        if state is None:
             self.elements = []
+        else:
+            snapshot = self.get_snapshot()
+
+            if snapshot and snapshot.open(state):
+                debug_message("Using snapshot %s", snapshot.filename)
+                self.elements = [
+                    SnapshotFileCoverage(snapshot, record)
+                    for record in snapshot.records
+                ]
+                self.summarised = True
+            else:
+                if self.use_process(state):
+                    self.elements = self.read_in_process()
+                else:
+                    self.elements = self.read()
+
+                if snapshot and self.snapshots:
+                    self.write_snapshot(snapshot, state)
+
+        self.build_index()
+
+        # data superseded while it was being loaded isn't kept
+        try:
+            self.check_cancelled()
+        except LoadCancelled:
+            self.release()
+            raise
+
+    def read(self):
+        """
+        Reads the <file> elements from the coverage file.
+        """
+        root = xml.etree.ElementTree.parse(self.coverage_file)
+        self.check_cancelled()
+        return root.findall('./project//file')
+
+    def use_process(self, state):
+        """
+        Determines whether to parse the coverage file, whose fingerprint
+        is given, in a worker process.
+        """
+        threshold = config.get('process_threshold')
+        if not self.process or threshold is None or not worker.available():
+            return False
+
+        return state[0] >= threshold * 1024 * 1024
+
+    def read_in_process(self):
+        """
+        Parses the coverage file in a worker process, returning a list
+        of parsed FileCoverage objects. Falls back to parsing it in
+        this process if that's not possible.
+        """
+        try:
+            records = worker.run(summarise, self.coverage_file)
+        except worker.WorkerUnavailable as e:
+            debug_message("Parsing in this process instead: %s", e)
+            return self.read()
+
+        self.check_cancelled()
+        self.summarised = True
+        summaries = []
+
+        for name, num_lines, covered, statements, good, bad in records:
+            coverage = FileCoverage(name, None)
+            coverage.populate(
+                num_lines, covered, statements, unpack(good), unpack(bad))
+            summaries.append(coverage)
+
+        return summaries
+
+    def entries(self):
+        """
+        Generates (name, data) pairs for each file in the loaded
+        coverage data, where name is the filename as it appears in the
+        coverage file.
+
+        The data is either a <file> element, or if self.summarised is
+        set, a FileCoverage object.
+        """
+        for data in self.elements or ():
+            if self.summarised:
+                yield data.filename, data
+            else:
+                yield data.get('name'), data
+
+    def file_coverage(self, filename, data):
+        """
+        Creates a FileCoverage object from an entry in self.elements.
+        """
+        if self.summarised:
+            return data
+
+        return FileCoverage(filename, data)
+
+    def get_snapshot(self):
+        """
+        Gets the Snapshot for the coverage file, or None if snapshots
+        are disabled. Snapshots are stored in the "snapshot_dir"
+        directory if it's set, otherwise next to the coverage file.
+        """
+        if not config.get('snapshot', False):
+            return None
+
+        directory = config.get('snapshot_dir')
+        if not directory:
+            return Snapshot(self.coverage_file + '.snapshot')
+
+        path = os.path.abspath(self.coverage_file).encode('utf-8')
+        name = hashlib.sha1(path).hexdigest() + '.snapshot'
+        return Snapshot(os.path.join(os.path.expanduser(directory), name))
+
+    def write_snapshot(self, snapshot, state):
+        """
+        Writes a snapshot of the loaded data, which requires parsing
+        the data for every file. If any of it can't be parsed, no
+        snapshot is written.
+        """
+        files = []
+
+        try:
+            # parse everything before writing, to leave no partial file
+            for name, data in self.entries():
+                coverage = self.file_coverage(name, data)
+                coverage.get('_num_lines')
+                files.append(coverage)
+
+            directory = os.path.dirname(snapshot.filename)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            snapshot.write(state, files)
+        except (IOError, OSError) + PARSE_ERRORS as e:
+            debug_message("Couldn't write snapshot: %s", e)
+
+    @timed('data.index')
+    def build_index(self):
+        """
+        Builds an index mapping each filename in the loaded coverage
+        data to its data. Filenames are only made absolute here, which
+        doesn't touch the filesystem, so building the index is cheap.
+        """
+        self.index = {}
+        self.resolved = None
+        for name, data in self.entries():
+            self.index[os.path.normcase(os.path.abspath(name))] = data
+
+    def lookup(self, filename):
+        """
+        Finds the data for a normalised filename, or None if there is
+        no coverage data for the file.
+
+        Filenames in coverage files are usually already real paths, so
+        the cheap index is tried first. If that misses, the filenames
+        are fully normalised (resolving symlinks) into a second index,
+        which happens at most once per load.
+        """
+        if self.index is None:
+            self.build_index()
+
+        data = self.index.get(filename)
+        if data is not None:
+            return data
+
+        if self.resolved is None:
+            self.resolved = {}
+            for name, data in self.entries():
+                self.resolved[self.normalise(name)] = data
+
+        return self.resolved.get(filename)
 
     def normalise(self, filename):
         """
-        Normalises a filename to aid comparisons.
+        Normalises a filename to aid comparisons. The result is
+        memoised, as resolving symlinks requires system calls.
         """
-        return os.path.normcase(os.path.realpath(filename))
+        if filename not in self.normalised:
+            self.normalised[filename] = os.path.normcase(
+                os.path.realpath(filename))
+
+        return self.normalised[filename]
 
     def get_file(self, filename):
         """
         Gets a FileCoverage object for a particular source file, which
         will represent the coverage data for that source file.
         """
-        if not self.is_loaded():
-            self.load()
-
+        self.ensure_loaded()
         filename = self.normalise(filename)
 
         # check in self.files cache
@@ -51,37 +325,633 @@ class CoverageData():
             self.files[filename] = None
 
             # find coverage data in the parsed XML coverage file
-            for data in self.elements:
-                if self.normalise(data.get('name')) == filename:
-                    # create FileCoverage with the data
-                    self.files[filename] = FileCoverage(filename, data)
+            data = self.lookup(filename)
+            if data is not None:
+                # create FileCoverage with the data
+                self.files[filename] = self.file_coverage(filename, data)
 
         return self.files[filename]
 
+    def reuse(self, previous, filename):
+        """
+        Compares the coverage data for a source file with a previous
+        generation of the coverage data. If it's unchanged, the previous
+        FileCoverage object is re-used, and True is returned.
+
+        Only source files whose coverage was requested from the previous
+        generation can be compared; for any others, returns False.
+        """
+        key = self.normalise(filename)
+        if key not in previous.files:
+            return False
+
+        old = previous.files[key]
+        new = self.get_file(filename)
+
+        if old is None or new is None:
+            return old is new
+
+        if old.digest() != new.digest():
+            return False
+
+        self.files[key] = old
+        return True
+
+
+class StreamingCoverageData(CoverageData):
+
+    """
+    A CoverageData which reads the coverage file incrementally.
+
+    Rather than keeping the whole XML tree in memory, each <file>
+    element is parsed into a FileCoverage summary as soon as it has
+    been read, and is then discarded. Peak memory usage depends on the
+    size of the largest <file> element, rather than the size of the
+    whole coverage file. Malformed <file> elements are skipped, rather
+    than failing the whole load.
+    """
+
+    def read(self):
+        """
+        Reads the coverage file, returning a list of parsed
+        FileCoverage objects.
+        """
+        self.summarised = True
+        summaries = []
+        stack = []
+
+        events = ('start', 'end')
+        for event, element in xml.etree.ElementTree.iterparse(
+                self.coverage_file, events):
+            if event == 'start':
+                stack.append(element)
+                continue
+
+            stack.pop()
+
+            if element.tag != 'file':
+                continue
+
+            # only <file> elements inside <project> are coverage data
+            if not any(parent.tag == 'project' for parent in stack):
+                continue
+
+            self.check_cancelled()
+            coverage = FileCoverage(element.get('name'), element)
+            try:
+                coverage.parse()
+            except PARSE_ERRORS as e:
+                debug_message("Skipping <file> element for %s: %s",
+                              coverage.filename, e)
+            else:
+                summaries.append(coverage)
+
+            # detach the consumed element so it can be freed
+            element.clear()
+            stack[-1].remove(element)
+
+        return summaries
+
+
+class ScanningCoverageData(StreamingCoverageData):
+
+    """
+    A CoverageData which scans the raw bytes of the coverage file for
+    the parts of the Clover format it needs, without building any XML
+    elements at all.
+
+    PHPUnit always writes coverage files in the same shape, so this is
+    much faster than parsing them as XML. If the coverage file contains
+    anything unexpected, it's read by StreamingCoverageData instead.
+    """
+
+    def read(self):
+        """
+        Scans the coverage file, returning a list of parsed
+        FileCoverage objects.
+        """
+        with open(self.coverage_file, 'rb') as f:
+            data = f.read()
+
+        try:
+            records = scanner.scan(data)
+        except scanner.ScanError as e:
+            debug_message("Parsing %s as XML: %s", self.coverage_file, e)
+            return super(ScanningCoverageData, self).read()
+
+        del data
+        self.check_cancelled()
+        self.summarised = True
+        summaries = []
+
+        for name, num_lines, covered, statements, good, bad in records:
+            coverage = FileCoverage(name, None)
+            coverage.populate(num_lines, covered, statements, good, bad)
+            summaries.append(coverage)
+
+        return summaries
+
+
+class IndexedCoverageData(CoverageData):
+
+    """
+    A CoverageData which only parses the data for files as they're
+    requested.
+
+    Loading scans the raw bytes of the coverage file for <file>
+    elements inside the <project> element, recording the byte offsets
+    where each one starts and ends. Requesting the coverage data for a
+    file only parses the slice of the coverage file containing its
+    <file> element. If a <file> start tag can't be parsed, the whole
+    coverage file is parsed as XML instead.
+    """
+
+    # scanning is cheap, and parsing happens on demand
+    process = False
+    snapshots = False
+
+    def read(self):
+        """
+        Scans the coverage file, returning a list of SliceFileCoverage
+        objects representing each <file> element in it.
+        """
+        self.summarised = True
+
+        try:
+            return self.scan()
+        except xml.etree.ElementTree.ParseError as e:
+            debug_message("Parsing %s as XML: %s", self.coverage_file, e)
+            self.summarised = False
+            return super(IndexedCoverageData, self).read()
+
+    def scan(self):
+        """
+        Finds the byte offsets of each <file> element in the <project>
+        element, returning a list of SliceFileCoverage objects.
+        """
+        slices = []
+
+        with open(self.coverage_file, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return slices
+
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            project = PROJECT_TAG.search(data)
+            limit = data.rfind(b'</project>')
+            if project is None or limit == -1:
+                return slices
+
+            match = FILE_TAG.search(data, project.end(), limit)
+            while match:
+                start, tag_end = match.span()
+                tag = match.group()
+
+                if tag.endswith(b'/>'):
+                    end = tag_end
+                else:
+                    end = data.find(b'</file>', tag_end, limit)
+                    if end == -1:
+                        break
+                    end += len(b'</file>')
+
+                self.check_cancelled()
+                name = self.tag_name(tag)
+                slices.append(SliceFileCoverage(
+                    name, (self.coverage_file, start, end)))
+
+                match = FILE_TAG.search(data, end, limit)
+        finally:
+            data.close()
+
+        return slices
+
+    def tag_name(self, tag):
+        """
+        Gets the value of the "name" attribute of a <file> start tag.
+        The tag is parsed as XML so that any entities are decoded.
+        """
+        if not tag.endswith(b'/>'):
+            tag = tag[:-1] + b'/>'
+
+        return xml.etree.ElementTree.fromstring(tag).get('name')
+
+
+class MergedCoverageData(CoverageData):
+
+    """
+    Represents the coverage data in several coverage files (shards),
+    such as those written by each worker of a parallel test run. The
+    coverage_file is a glob pattern matching the shards.
+
+    Each shard is loaded as a CoverageData of its own, through a
+    CoverageDataFactory, so shards are cached individually. When one
+    shard changes, only that shard is parsed again; the data for the
+    others is re-used from the cache. Shards which aren't loaded yet
+    are loaded in parallel, each in a thread of its own.
+
+    The coverage data for a source file is merged from every shard
+    containing it when it's first requested, using merge().
+    """
+
+    # the shards decide for themselves
+    process = False
+
+    # the factory used to get the data for each shard
+    coverage_factory = None
+
+    def get_coverage_factory(self):
+        """
+        Gets the factory used to get the data for each shard. If none is
+        set, it instantiates an instance of the default
+        CoverageDataFactory class.
+        """
+        if not self.coverage_factory:
+            self.coverage_factory = CoverageDataFactory()
+
+        return self.coverage_factory
+
+    @timed('data.load')
+    def load(self):
+        """
+        Loads the data from every shard matching the pattern.
+
+        Raises LoadCancelled if the data is cancelled before it's
+        completely loaded, or if a newer version of a shard is found
+        while it's being loaded.
+        """
+        self.check_cancelled()
+        self.files = {}
+
+        factory = self.get_coverage_factory()
+        shards = [factory.factory(shard)
+                  for shard in sorted(glob.glob(self.coverage_file))]
+
+        self.load_shards([s for s in shards if not s.is_loaded()])
+        self.check_cancelled()
+
+        self.summarised = True
+        self.elements = shards
+
+    def load_shards(self, shards):
+        """
+        Loads shards in parallel, re-raising the first exception raised
+        while loading any of them.
+        """
+        errors = []
+
+        def load(shard):
+            try:
+                shard.ensure_loaded()
+            except Exception as e:
+                errors.append(e)
+
+        threads = []
+        for shard in shards[1:]:
+            thread = threading.Thread(target=load, args=(shard,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # the first shard is loaded in this thread
+        for shard in shards[:1]:
+            load(shard)
+
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+    def entries(self):
+        """
+        Generates (name, data) pairs for each file in any of the shards,
+        where the data is a FileCoverage object merged from every shard
+        containing the file.
+        """
+        parts = collections.OrderedDict()
+
+        for shard in self.elements:
+            for name, data in shard.entries():
+                coverage = shard.file_coverage(name, data)
+                parts.setdefault(name, []).append(coverage)
+
+        for name, coverage in parts.items():
+            yield name, merge(name, coverage)
+
+    def get_file(self, filename):
+        """
+        Gets a FileCoverage object for a particular source file, merged
+        from the coverage data for it in every shard. Only the shards'
+        data for that source file is parsed.
+        """
+        self.ensure_loaded()
+        key = self.normalise(filename)
+
+        if key not in self.files:
+            parts = [shard.get_file(filename) for shard in self.elements]
+            parts = [part for part in parts if part is not None]
+            self.files[key] = merge(key, parts) if parts else None
+
+        return self.files[key]
+
+
+class LoadCancelled(Exception):
+
+    """
+    An exception raised when loading coverage data that has been
+    superseded by a newer version of the coverage file.
+    """
+
+    pass
+
+
+def summarise(coverage_file):
+    """
+    Parses a coverage file, returning a compact tuple for each file in
+    it: (name, lines, covered, statements, good lines, bad lines), with
+    the line numbers packed into bytes.
+
+    This is run in a worker process by CoverageData.read_in_process(),
+    so the result is cheap to send back to the plugin.
+    """
+    return [
+        (
+            coverage.filename,
+            coverage.num_lines,
+            coverage.covered,
+            coverage.statements,
+            pack(coverage.get('_good_lines')),
+            pack(coverage.get('_bad_lines')),
+        )
+        for coverage in ScanningCoverageData(coverage_file).read()
+    ]
+
+
+def merge(filename, parts):
+    """
+    Merges the FileCoverage objects for a source file from several
+    shards into one. A line is covered if it's covered in any shard
+    (so its hit count is effectively the highest in any shard), and
+    uncovered if it's a statement in any shard but covered in none.
+
+    Every shard measures the same source file, so the number of lines
+    and statements are the highest in any shard rather than the sum.
+    The number of covered statements is the number of distinct covered
+    lines, but never less than in any single shard.
+    """
+    if len(parts) == 1:
+        return parts[0]
+
+    good = set()
+    bad = set()
+
+    for part in parts:
+        good.update(part.get('_good_lines'))
+        bad.update(part.get('_bad_lines'))
+
+    statements = max(part.statements for part in parts)
+    covered = max([len(good)] + [part.covered for part in parts])
+
+    coverage = FileCoverage(filename, None)
+    coverage.populate(
+        max(part.num_lines for part in parts),
+        min(covered, statements),
+        statements,
+        sorted(good),
+        sorted(bad - good),
+    )
+
+    return coverage
+
+
+def fingerprint_shards(pattern):
+    """
+    Gets a fingerprint of the current state of the files matching a
+    glob pattern, made up of each matching file's name and fingerprint.
+    Returns None if no files match.
+
+    The size in the fingerprint is always zero, as the size of each
+    shard is accounted for by its own CoverageDataCache entry.
+    """
+    shards = sorted(glob.glob(pattern))
+    if not shards:
+        return None
+
+    return (0, tuple((shard, fingerprint(shard)) for shard in shards))
+
+
+def fingerprint(filename):
+    """
+    Gets a cheap fingerprint of a file's current state, made up of its
+    size, modification time and inode number. Returns None if the file
+    doesn't exist.
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+
+    mtime = getattr(stat, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(stat.st_mtime * 1000000000)
+
+    return (stat.st_size, mtime, stat.st_ino)
+
+
+class CoverageDataCache():
+
+    """
+    A process-wide cache of CoverageData objects, shared between all
+    CoverageDataFactory instances so that every user of a coverage
+    file shares a single parse of it.
+
+    Entries are keyed by the coverage file's path and fingerprint, so
+    a changed coverage file is never served from the cache. When a new
+    version of a cached coverage file is loaded, the CoverageData for
+    the previous version is cancelled and released, so only one version
+    of each coverage file is kept in memory. The least recently used
+    entries are evicted once the total size of the cached coverage
+    files exceeds the "cache_size" setting (in megabytes).
+    The size of a coverage file on disk is used as an estimate of the
+    memory used by its parsed data.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_budget(self):
+        """
+        Gets the maximum total size of cached coverage files, in bytes.
+        """
+        if self.budget is not None:
+            return self.budget
+
+        return int(config.get('cache_size', 64) * 1024 * 1024)
+
+    def get(self, coverage_file, class_name):
+        """
+        Gets the cached CoverageData for a coverage file, creating one
+        using class_name if it's not cached yet. The coverage file may
+        be a glob pattern matching several shards.
+        """
+        if is_pattern(coverage_file):
+            state = fingerprint_shards(coverage_file)
+        else:
+            state = fingerprint(coverage_file)
+
+        path = os.path.abspath(coverage_file)
+        key = (class_name, path, state)
+
+        # nonexistent files can't be told apart, so aren't cached
+        if state is None:
+            with self.lock:
+                self.drop(key)
+            return class_name(coverage_file)
+
+        with self.lock:
+            if key in self.entries:
+                # re-insert to mark as most recently used
+                data = self.entries.pop(key)
+                self.entries[key] = data
+                return data
+
+            self.drop(key)
+            data = class_name(coverage_file)
+            self.entries[key] = data
+            self.evict()
+
+            return data
+
+    def drop(self, key):
+        """
+        Drops, cancels and releases the entries for previous versions
+        of the coverage file in the given key.
+        """
+        for stale in list(self.entries):
+            if stale[:2] == key[:2]:
+                previous = self.entries.pop(stale)
+                previous.cancel()
+                previous.release()
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache is within
+        its budget. The most recently used entry is always kept.
+        """
+        budget = self.get_budget()
+        total = sum(key[2][0] for key in self.entries)
+
+        while total > budget and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            del self.entries[key]
+            total -= key[2][0]
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        with self.lock:
+            self.entries.clear()
+
+
+cache = CoverageDataCache()
+
 
 class CoverageDataFactory():
 
     """
     Creates instances of CoverageData objects.
+
+    If no class is given, the class is chosen by the "loader" setting:
+    "tree" (the default) parses the whole coverage file into memory,
+    "stream" reads it incrementally using StreamingCoverageData, "scan"
+    scans its raw bytes using ScanningCoverageData, and "index" only
+    parses requested files using IndexedCoverageData.
+
+    If the coverage file is a glob pattern, a MergedCoverageData is
+    created instead, which uses the class chosen as above for each of
+    the shards matching the pattern.
+
+    Instances are shared through a CoverageDataCache (by default, the
+    process-wide cache), so repeated calls for an unchanged coverage
+    file return the same CoverageData object.
     """
 
-    def __init__(self, class_name=CoverageData):
+    loaders = {
+        'tree': CoverageData,
+        'stream': StreamingCoverageData,
+        'scan': ScanningCoverageData,
+        'index': IndexedCoverageData,
+    }
+
+    def __init__(self, class_name=None, cache=None):
         self.class_name = class_name
+        self.cache = cache
+
+    def get_class(self):
+        """
+        Gets the CoverageData class to instantiate.
+        """
+        if self.class_name:
+            return self.class_name
+
+        return self.loaders.get(config.get('loader', 'tree'), CoverageData)
+
+    def get_cache(self):
+        """
+        Gets the cache for the factory. If none is set, the
+        process-wide cache is used.
+        """
+        return self.cache or cache
 
     def factory(self, coverage_file):
-        return self.class_name(coverage_file)
+        if not is_pattern(coverage_file):
+            return self.get_cache().get(coverage_file, self.get_class())
+
+        data = self.get_cache().get(coverage_file, MergedCoverageData)
+        if data.coverage_factory is None:
+            data.coverage_factory = CoverageDataFactory(
+                self.class_name, self.cache)
 
+        return data
 
-class FileCoverage():
+
+class FileCoverage(object):
 
     """
     Represents coverage data for a single file.
+
+    The data is parsed when any of the num_lines, covered, statements,
+    good_lines or bad_lines attributes is first accessed. To keep the
+    memory used for each file small, the line numbers are stored in
+    arrays of 32-bit integers, and the source data is discarded once
+    it has been parsed.
     """
 
+    __slots__ = (
+        'filename',
+        'data',
+        'parsed',
+        '_num_lines',
+        '_covered',
+        '_statements',
+        '_good_lines',
+        '_bad_lines',
+    )
+
     def __init__(self, filename, data):
         self.filename = filename
         self.data = data
         self.parsed = False
+        self._num_lines = None
+        self._covered = None
+        self._statements = None
+        self._good_lines = None
+        self._bad_lines = None
 
     def is_parsed(self):
         """
@@ -96,12 +966,12 @@ class FileCoverage():
         """
         metrics = self.data.find('./metrics')
 
-        self.num_lines = int(metrics.get('loc'))
-        self.covered = int(metrics.get('coveredstatements'))
-        self.statements = int(metrics.get('statements'))
+        num_lines = int(metrics.get('loc'))
+        covered = int(metrics.get('coveredstatements'))
+        statements = int(metrics.get('statements'))
 
-        self.good_lines = []
-        self.bad_lines = []
+        good_lines = array.array(LINE_TYPE)
+        bad_lines = array.array(LINE_TYPE)
 
         for line in self.data.findall('line'):
             # skip non-statement lines
@@ -113,32 +983,152 @@ class FileCoverage():
 
             # quirks in the coverage data: skip line #0 and any
             # lines greater than the number of lines in the file
-            if line_number == 0 or line_number > self.num_lines:
+            if line_number == 0 or line_number > num_lines:
                 continue
 
             # add this line number to good_lines or bad_lines depending
             # on whether it's covered by at least one test or not
-            dest = self.good_lines if test_count > 0 else self.bad_lines
+            dest = good_lines if test_count > 0 else bad_lines
             dest.append(line_number)
 
+        self.populate(num_lines, covered, statements, good_lines, bad_lines)
+
+    def populate(self, num_lines, covered, statements, good, bad):
+        """
+        Sets the structured data directly, marking it as parsed and
+        discarding the source data.
+        """
+        self._num_lines = num_lines
+        self._covered = covered
+        self._statements = statements
+        self._good_lines = self.pack(good)
+        self._bad_lines = self.pack(bad)
         self.parsed = True
+        self.data = None
 
-    def __getattr__(self, name):
+    def digest(self):
         """
-        Automatically parse when attempting to retrieve output values.
+        Gets a digest of the parsed coverage data, which is the same
+        for any two FileCoverage objects with the same data.
         """
-        methods = [
-            'num_lines',
-            'covered',
-            'statements',
-            'good_lines',
-            'bad_lines',
-        ]
+        sha1 = hashlib.sha1(struct.pack(
+            '<III', self.num_lines, self.covered, self.statements))
+        sha1.update(pack(self.get('_good_lines')))
+        sha1.update(b'|')
+        sha1.update(pack(self.get('_bad_lines')))
+        return sha1.digest()
 
-        if name in methods:
-            if not self.is_parsed():
+    def pack(self, lines):
+        """
+        Converts a sequence of line numbers to a compact array.
+        """
+        if isinstance(lines, array.array) and lines.typecode == LINE_TYPE:
+            return lines
+
+        return array.array(LINE_TYPE, lines)
+
+    def get(self, name):
+        """
+        Gets a parsed value, parsing the data first if necessary.
+        """
+        value = getattr(self, name)
+        if value is None:
+            with stats.timer('data.parse'):
                 self.parse()
+            value = getattr(self, name)
+
+        return value
+
+    @property
+    def num_lines(self):
+        return self.get('_num_lines')
+
+    @property
+    def covered(self):
+        return self.get('_covered')
+
+    @property
+    def statements(self):
+        return self.get('_statements')
+
+    @property
+    def good_lines(self):
+        return self.get('_good_lines').tolist()
+
+    @property
+    def bad_lines(self):
+        return self.get('_bad_lines').tolist()
+
+
+class SnapshotFileCoverage(FileCoverage):
+
+    """
+    Represents coverage data for a single file read from a Snapshot.
+    The metrics are available immediately, and the line numbers are
+    read from the snapshot when they're first needed.
+    """
+
+    __slots__ = ('snapshot',)
+
+    def __init__(self, snapshot, record):
+        super(SnapshotFileCoverage, self).__init__(record[0], record)
+        self.snapshot = snapshot
+        self._num_lines, self._covered, self._statements = record[1:4]
 
-            return getattr(self, name)
+    def parse(self):
+        """
+        Reads the line numbers from the snapshot.
+        """
+        good, bad = self.snapshot.lines(self.data)
+        self.populate(
+            self._num_lines, self._covered, self._statements, good, bad)
+        self.snapshot = None
+
+
+class SliceFileCoverage(FileCoverage):
 
-        raise AttributeError()
+    """
+    Represents coverage data for a single file, stored in a slice of
+    the coverage file. The data is a tuple of the coverage file's name
+    and the byte offsets of the start and end of the <file> element.
+    The slice is only read and parsed when the data is first needed,
+    using the scanner if possible, and ElementTree otherwise. If the
+    slice no longer contains the <file> element for the same file,
+    ValueError is raised rather than returning another file's data.
+    """
+
+    __slots__ = ()
+
+    def parse(self):
+        """
+        Reads and parses the slice of the coverage file.
+        """
+        coverage_file, start, end = self.data
+
+        with open(coverage_file, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+
+        if not data.startswith(b'<file'):
+            raise ValueError("Coverage file changed since it was indexed")
+
+        try:
+            record = scanner.scan_element(data)
+        except scanner.ScanError:
+            element = xml.etree.ElementTree.fromstring(data)
+            self.check_name(element.get('name'))
+            self.data = element
+            super(SliceFileCoverage, self).parse()
+            return
+
+        self.check_name(record[0])
+        self.populate(*record[1:])
+
+    def check_name(self, name):
+        """
+        Raises ValueError if the <file> element read from the slice is
+        for a different file, which happens if the coverage file has
+        been rewritten since it was indexed.
+        """
+        if name != self.filename:
+            raise ValueError("Coverage file changed since it was indexed")
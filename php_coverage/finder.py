@@ -1,7 +1,89 @@
+import glob
 import os
+import re
+import threading
+import time
 
 from php_coverage.config import config
 from php_coverage.debug import debug_message
+from php_coverage.stats import stats, timed
+
+# Seconds to remember that no coverage file was found for a directory
+NEGATIVE_TTL = 10
+
+# Seconds to remember which coverage file was found for a directory
+POSITIVE_TTL = 60
+
+# Characters which make a report path a glob pattern
+MAGIC = re.compile('[*?[]')
+
+
+class FinderCache():
+
+    """
+    Remembers which coverage file was found for each directory, shared
+    between all CoverageFinders.
+
+    Entries are keyed by the report path setting and the directory, so
+    changing the setting doesn't return stale results. Entries expire,
+    as a new coverage file can appear at any time (possibly closer to
+    the source file) without anything watching for it: directories for
+    which no coverage file was found are remembered for NEGATIVE_TTL
+    seconds, and others for POSITIVE_TTL seconds.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, path, directory):
+        """
+        Gets a tuple of (found, coverage) for a directory, where found
+        is False if the directory isn't cached.
+        """
+        with self.lock:
+            entry = self.entries.get((path, directory))
+
+        if entry is None:
+            return False, None
+
+        coverage, expires = entry
+        if expires < time.time():
+            return False, None
+
+        return True, coverage
+
+    def set(self, path, directories, coverage):
+        """
+        Remembers the coverage file found for a list of directories.
+        """
+        ttl = POSITIVE_TTL if coverage else NEGATIVE_TTL
+        expires = time.time() + ttl
+
+        with self.lock:
+            for directory in directories:
+                self.entries[(path, directory)] = (coverage, expires)
+
+    def invalidate(self, coverage_file):
+        """
+        Forgets entries which may be affected by a coverage file being
+        created or deleted: those which found that coverage file, and
+        those which found no coverage file at all.
+        """
+        with self.lock:
+            for key, (coverage, expires) in list(self.entries.items()):
+                if coverage is None or coverage == coverage_file:
+                    del self.entries[key]
+
+    def clear(self):
+        """
+        Forgets all entries.
+        """
+        with self.lock:
+            self.entries.clear()
+
+
+cache = FinderCache()
 
 
 class CoverageFinder():
@@ -9,9 +91,31 @@ class CoverageFinder():
     """
     Finds the filename containing coverage data for a particular file.
     Currently it ascends through parent directories, until it finds
-    "build/logs/clover.xml".
+    the "report_path" setting (by default "build/logs/clover.xml").
+
+    If the setting is a glob pattern, such as "build/logs/clover-*.xml"
+    for a test suite split into shards, the first directory in which
+    it matches any files is used, and the pattern (joined to that
+    directory) is returned in place of a filename.
+
+    Results are remembered for each directory visited along the way in
+    a FinderCache (by default, the shared one), so files in the same
+    directory or in sibling directories share lookups. A remembered
+    coverage file is checked to still exist before it's used, so one
+    which has been deleted is looked for again.
     """
 
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def get_cache(self):
+        """
+        Gets the cache for the finder. If none is set, the shared cache
+        is used.
+        """
+        return self.cache or cache
+
+    @timed('finder.find')
     def find(self, filename):
         """
         Finds the coverage file for a given filename.
@@ -19,15 +123,63 @@ class CoverageFinder():
         # start from the file's directory
         parent, current = os.path.split(os.path.abspath(filename))
         path = os.path.normcase(os.path.normpath(config.report_path))
+        pattern = is_pattern(path)
+        cache = self.get_cache()
+        visited = []
+        coverage = None
 
         # iterate through parent directories until coverage file found
         while current:
-            coverage = os.path.join(parent, path)
-            if os.path.exists(coverage):
-                debug_message("Coverage for %s in %s" % (filename, coverage))
-                return coverage
+            found, cached = cache.get(path, parent)
+            if found and (cached is None or exists(cached, pattern)):
+                stats.count('finder.cache_hit')
+                coverage = cached
+                break
+
+            visited.append(parent)
+            if pattern:
+                candidate = os.path.join(escape(parent), path)
+            else:
+                candidate = os.path.join(parent, path)
+
+            if exists(candidate, pattern):
+                coverage = candidate
+                break
 
             parent, current = os.path.split(parent)
 
-        debug_message("Coverage file not found for " + str(filename))
-        return None
+        cache.set(path, visited, coverage)
+
+        if coverage:
+            debug_message("Coverage for %s in %s", filename, coverage)
+        else:
+            debug_message("Coverage file not found for %s", filename)
+
+        return coverage
+
+
+def is_pattern(path):
+    """
+    Determines whether a report path is a glob pattern.
+    """
+    return MAGIC.search(path) is not None
+
+
+def exists(candidate, pattern):
+    """
+    Determines whether a coverage file exists, or if the report path is
+    a glob pattern, whether any files match it.
+    """
+    if pattern:
+        return bool(glob.glob(candidate))
+
+    return os.path.exists(candidate)
+
+
+def escape(path):
+    """
+    Escapes any glob pattern characters in a path, so it only matches
+    itself when used as part of a glob pattern.
+    """
+    drive, path = os.path.splitdrive(path)
+    return drive + MAGIC.sub(r'[\g<0>]', path)
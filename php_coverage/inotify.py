@@ -0,0 +1,255 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+# inotify_init1() flags
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# inotify event masks
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+
+# Events on a directory entry which may change the file's state
+FILE_EVENTS = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+               IN_DELETE)
+
+# Events meaning the watched directory itself has gone away
+DIRECTORY_EVENTS = IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+
+# Header of each event read from an inotify file descriptor
+EVENT = struct.Struct('iIII')
+
+# Time to wait for further events after the first one, in seconds
+LATENCY = 0.1
+
+
+def load_libc():
+    """
+    Loads the C library, returning None if it doesn't provide inotify.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    libc.inotify_add_watch.argtypes = [
+        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+libc = load_libc()
+
+
+def available():
+    """
+    Determines whether inotify is available on this system.
+    """
+    return libc is not None
+
+
+def encode(filename):
+    """
+    Encodes a filename to bytes, as used by the inotify API.
+    """
+    if isinstance(filename, bytes):
+        return filename
+
+    return filename.encode(sys.getfilesystemencoding() or 'utf-8')
+
+
+class Inotify():
+
+    """
+    A minimal wrapper around an inotify file descriptor.
+    """
+
+    def __init__(self):
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1() failed")
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """
+        Watches a path for events in mask, returning the watch ID.
+        """
+        wd = libc.inotify_add_watch(self.fd, encode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch() failed")
+
+        return wd
+
+    def rm_watch(self, wd):
+        """
+        Stops watching the path with the given watch ID.
+        """
+        libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """
+        Reads pending events, returning a list of (watch ID, mask,
+        name) tuples. Returns an empty list if there are none.
+        """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, name))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class InotifyBackend():
+
+    """
+    Waits for changes to a set of files using a single inotify file
+    descriptor, rather than polling.
+
+    The directory containing each file is watched, so that the file
+    being created, deleted or replaced is also detected. If one of the
+    directories is deleted or moved, its files are reported as broken,
+    and should be polled instead from then on.
+    """
+
+    def __init__(self):
+        self.inotify = Inotify()
+        self.pipe = os.pipe()
+        self.files = {}
+        self.directories = {}
+
+    def add(self, filename):
+        """
+        Starts watching a file. Raises OSError if it can't be watched.
+        """
+        path = os.path.abspath(filename)
+        directory, name = os.path.split(path)
+
+        wd = self.inotify.add_watch(directory, FILE_EVENTS | DIRECTORY_EVENTS)
+        self.files[(wd, encode(name))] = path
+        self.directories.setdefault(wd, set()).add(path)
+
+    def remove(self, filename):
+        """
+        Stops watching a file, and its directory if no other watched
+        files are in it.
+        """
+        path = os.path.abspath(filename)
+
+        for key, watched in list(self.files.items()):
+            if watched != path:
+                continue
+
+            wd = key[0]
+            del self.files[key]
+            self.directories[wd].discard(path)
+
+            if not self.directories[wd]:
+                del self.directories[wd]
+                self.inotify.rm_watch(wd)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until a watched file may have changed, wake() is called,
+        or the timeout (in seconds) expires.
+
+        Returns a tuple of two sets of paths: those of files which may
+        have changed, and those of files whose directory has gone away.
+
+        After the first event, any further events within LATENCY
+        seconds are coalesced, so a burst of writes only wakes the
+        caller once. Events for other files in the same directory don't
+        extend the wait beyond the timeout.
+        """
+        changed = set()
+        broken = set()
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.time())
+
+            readable = select.select(
+                [self.inotify, self.pipe[0]], [], [], remaining)[0]
+
+            if not readable:
+                break
+
+            if self.pipe[0] in readable:
+                os.read(self.pipe[0], 1024)
+                break
+
+            for wd, mask, name in self.inotify.read():
+                if mask & DIRECTORY_EVENTS:
+                    paths = self.directories.pop(wd, set())
+                    broken.update(paths)
+                    changed.update(paths)
+                elif (wd, name) in self.files:
+                    changed.add(self.files[(wd, name)])
+
+            # remove files from directories which have gone away
+            for key, path in list(self.files.items()):
+                if path in broken:
+                    del self.files[key]
+
+            if changed:
+                latest = time.time() + LATENCY
+                if deadline is None or latest < deadline:
+                    deadline = latest
+
+            if deadline is not None and time.time() >= deadline:
+                break
+
+        return changed, broken
+
+    def wake(self):
+        """
+        Wakes up a thread blocked in wait().
+        """
+        try:
+            os.write(self.pipe[1], b'x')
+        except OSError:
+            # already closed by the thread that was waiting
+            pass
+
+    def close(self):
+        """
+        Releases the inotify file descriptor and wake-up pipe.
+        """
+        self.inotify.close()
+        os.close(self.pipe[0])
+        os.close(self.pipe[1])
@@ -1,6 +1,134 @@
+import collections
 import re
+import threading
 
 from php_coverage.config import config
+from php_coverage.stats import stats, timed
+
+# Maximum number of filenames to remember decisions for
+CACHE_SIZE = 1024
+
+# An inline flag group, such as (?i), which applies to a whole pattern
+INLINE_FLAGS = re.compile(r'\(\?[aiLmsux]+\)')
+
+
+class PatternList():
+
+    """
+    A list of compiled patterns, which can be searched as if it were
+    a single compiled pattern. Used when patterns can't be combined.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+
+    def search(self, string):
+        for pattern in self.patterns:
+            match = pattern.search(string)
+            if match:
+                return match
+
+        return None
+
+
+class MatcherCache():
+
+    """
+    Caches compiled patterns and decisions about filenames, shared
+    between all Matchers.
+
+    Each list of patterns is compiled into a single alternation. The
+    decisions for the most recently used CACHE_SIZE filenames are
+    remembered, and forgotten whenever the settings are loaded, or the
+    include or exclude lists are replaced.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.compiled = {}
+        self.decisions = collections.OrderedDict()
+        self.sources = None
+
+    def compile(self, patterns):
+        """
+        Compiles a list of patterns into an object with a search()
+        method, which finds a match for any of the patterns.
+        """
+        key = tuple(patterns)
+
+        if key not in self.compiled:
+            self.compiled[key] = self.combine(key)
+
+        return self.compiled[key]
+
+    def combine(self, patterns):
+        """
+        Combines a list of patterns into a single compiled pattern. If
+        they can't be combined (because group numbers would change, or
+        a pattern has inline flags, which would apply to every pattern
+        in the combination), a PatternList is used instead.
+        """
+        compiled = PatternList(patterns)
+
+        if any(pattern.groups for pattern in compiled.patterns):
+            return compiled
+
+        if any(INLINE_FLAGS.search(pattern) for pattern in patterns):
+            return compiled
+
+        try:
+            return re.compile('|'.join('(?:%s)' % p for p in patterns))
+        except re.error:
+            return compiled
+
+    def get(self, sources, filename):
+        """
+        Gets the remembered decision for a filename, or None if there
+        isn't one. The sources are the pattern lists the decision was
+        made with.
+        """
+        with self.lock:
+            if self.sources is None or not self.same(sources):
+                self.decisions.clear()
+                self.sources = sources
+                return None
+
+            decision = self.decisions.pop(filename, None)
+            if decision is not None:
+                self.decisions[filename] = decision
+
+            return decision
+
+    def same(self, sources):
+        """
+        Determines whether decisions were made with the given sources.
+        """
+        return all(a is b for a, b in zip(sources, self.sources))
+
+    def set(self, sources, filename, decision):
+        """
+        Remembers the decision for a filename.
+        """
+        with self.lock:
+            if self.sources is None or not self.same(sources):
+                return
+
+            self.decisions[filename] = decision
+            while len(self.decisions) > CACHE_SIZE:
+                self.decisions.popitem(last=False)
+
+    def clear(self):
+        """
+        Forgets all compiled patterns and decisions.
+        """
+        with self.lock:
+            self.compiled = {}
+            self.decisions.clear()
+            self.sources = None
+
+
+cache = MatcherCache()
+config.add_listener(cache.clear)
 
 
 class Matcher():
@@ -10,12 +138,32 @@ class Matcher():
     them or not.
     """
 
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def get_cache(self):
+        """
+        Gets the cache for the matcher. If none is set, the shared
+        cache is used.
+        """
+        return self.cache or cache
+
+    @timed('matcher.should_include')
     def should_include(self, filename):
         """
         Determines whether to include a file or not based on its
         filename and the settings in the plugin configuration.
         """
-        return self.included(filename) and not self.excluded(filename)
+        sources = (config.include, config.exclude)
+        decision = self.get_cache().get(sources, filename)
+
+        if decision is None:
+            decision = self.included(filename) and not self.excluded(filename)
+            self.get_cache().set(sources, filename, decision)
+        else:
+            stats.count('matcher.cache_hit')
+
+        return decision
 
     def included(self, filename):
         """
@@ -33,9 +181,7 @@ class Matcher():
         """
         Determines whether a string matches any of a list of patterns.
         """
-        for pattern in patterns:
-            if re.search(pattern, string):
-                return True
+        if not patterns:
+            return False
 
-        # no patterns matched
-        return False
+        return self.get_cache().compile(patterns).search(string) is not None
@@ -1,11 +1,12 @@
 import os
 
 from php_coverage.config import config
+from php_coverage.data import LoadCancelled
 from php_coverage.debug import debug_message
-from php_coverage.finder import CoverageFinder
-from php_coverage.helper import set_timeout_async
+from php_coverage.finder import CoverageFinder, is_pattern
 from php_coverage.matcher import Matcher
-from php_coverage.watcher import CoverageWatcher
+from php_coverage.updates import queue
+from php_coverage.watcher import CoverageWatcher, ShardedCoverageWatcher
 
 
 class ViewWatcherMediator():
@@ -28,18 +29,34 @@ class ViewWatcherMediator():
 
     This class re-uses CoverageWatchers, so if there's multiple views
     that need to be notified about the same coverage file, there will
-    be only one CoverageWatcher created.
+    be only one CoverageWatcher created. If the coverage file is a glob
+    pattern matching several shards, a ShardedCoverageWatcher is used.
 
     Calling remove(view) will de-register any watchers that were set
     up for a view by add(view). If this results in a CoverageWatchers
     having no more registered callbacks, that CoverageWatchers will be
     stopped. A new CoverageWatchers will be created and started next
     time a view is added using add(view).
+
+    CoverageWatchers don't have threads of their own; they're all
+    polled by a single shared thread, so stopping one doesn't block.
+
+    Callbacks are run later, in Sublime's async thread, through an
+    UpdateQueue (by default, the shared one), so the callbacks for all
+    the views of a coverage file are run together in one pass. The
+    queue only keeps the latest update for each view, so if the
+    coverage file changes again before then, only the newest coverage
+    data is applied. Before a callback is run, the coverage data for
+    the view's file is compared with the data last applied to it, and
+    the callback is skipped if it's unchanged. Doing this in the async
+    thread keeps parsing off the thread watching the coverage files.
     """
 
-    def __init__(self, callbacks={}, coverage_finder=None, matcher=None):
+    def __init__(self, callbacks={}, coverage_finder=None, matcher=None,
+                 update_queue=None):
         self.coverage_finder = coverage_finder or CoverageFinder()
         self.matcher = matcher or Matcher()
+        self.update_queue = update_queue or queue
         self.callbacks = callbacks
         self.watchers = {}
 
@@ -57,7 +74,7 @@ class ViewWatcherMediator():
             return
 
         if not self.matcher.should_include(filename):
-            debug_message("Ignoring excluded file '%s'" % filename)
+            debug_message("Ignoring excluded file '%s'", filename)
             return
 
         coverage = self.coverage_finder.find(filename)
@@ -68,30 +85,57 @@ class ViewWatcherMediator():
 
         # ensure a CoverageWatcher exists for the coverage file
         if not coverage in self.watchers:
-            debug_message("Creating CoverageWatcher for " + coverage)
-            self.watchers[coverage] = CoverageWatcher(coverage)
+            debug_message("Creating CoverageWatcher for %s", coverage)
+            self.watchers[coverage] = self.create_watcher(coverage)
         else:
-            debug_message("Found existing CoverageWatcher for " + coverage)
+            debug_message("Found existing CoverageWatcher for %s", coverage)
 
         watcher = self.watchers[coverage]
 
         # add callbacks as defined at construction time, also adding in
         # the relevant view as a parameter to the callback
         for event, callback in self.callbacks.items():
-            wrapped = self.prepare_callback(callback, view)
-            watcher.add_callback(event, view.id(), wrapped)
+            wrapped = self.prepare_callback(callback, view, watcher)
+            watcher.add_callback(event, view.id(), wrapped, filename)
 
         # start the watcher if it's not already running
         if not watcher.is_alive():
-            debug_message("Starting CoverageWatcher for " + coverage)
+            debug_message("Starting CoverageWatcher for %s", coverage)
             watcher.start()
 
-    def prepare_callback(self, callback, view):
+    def create_watcher(self, coverage):
+        """
+        Creates a CoverageWatcher for a coverage file, or for a glob
+        pattern matching several coverage files.
+        """
+        if is_pattern(coverage):
+            return ShardedCoverageWatcher(coverage)
+
+        return CoverageWatcher(coverage)
+
+    def prepare_callback(self, callback, view, watcher):
         """
-        Wraps a callback function in a lambda to add a view as an
-        additional parameter, and to be run in the main thread.
+        Wraps a callback function to add a view as an additional
+        parameter, and to be queued to run in the async thread, but
+        only if the coverage data for the view's file has changed.
         """
-        return lambda data: set_timeout_async(lambda: callback(view, data), 1)
+        def wrapped(data):
+            def run():
+                try:
+                    if not watcher.changed(view.id(), data):
+                        debug_message("Coverage unchanged for view %d",
+                                      view.id())
+                        return
+                except LoadCancelled as e:
+                    # the newer version will be (or has been) applied
+                    debug_message("Not updating view %d: %s", view.id(), e)
+                    return
+
+                callback(view, data)
+
+            self.update_queue.add(view, run)
+
+        return wrapped
 
     def remove(self, view):
         """
@@ -105,6 +149,6 @@ class ViewWatcherMediator():
             # if no more callbacks on this watcher, stop and remove it
             if not watcher.has_callbacks():
                 filename = watcher.filename
-                debug_message("Stopping CoverageWatcher for '%s'" % filename)
-                watcher.stop(1)
+                debug_message("Stopping CoverageWatcher for '%s'", filename)
+                watcher.stop()
                 del self.watchers[id]
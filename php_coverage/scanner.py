@@ -0,0 +1,243 @@
+import array
+import re
+import xml.etree.ElementTree
+
+from php_coverage.snapshot import LINE_TYPE
+
+# The name of an element's start tag
+TAG = re.compile(br'<([A-Za-z_][\w.:-]*)')
+
+# The name attribute of a <file> start tag
+NAME = re.compile(br'\sname="([^"<]*)"')
+
+# Statement <line> elements, as written by PHPUnit, which are covered
+# by at least one test (good) or by none (bad)
+GOOD = re.compile(
+    br'<line\s+num="(\d+)"\s+type="stmt"\s+count="0*[1-9]\d*"\s*/>')
+BAD = re.compile(
+    br'<line\s+num="(\d+)"\s+type="stmt"\s+count="0+"\s*/>')
+
+# Any other <line> elements, such as those for methods
+OTHER = re.compile(
+    br'<line\s+num="\d+"\s+type="(?!stmt")[^"<>]*"'
+    br'(?:\s+[\w-]+="[^"<>]*")*?\s+count="\d+"\s*/>'
+)
+
+# A <metrics> element
+METRICS = re.compile(br'<metrics(\s[^>]*)/>')
+
+# The metrics used from a file's <metrics> element
+LOC = re.compile(br'\sloc="(\d+)"')
+STATEMENTS = re.compile(br'\sstatements="(\d+)"')
+COVERED = re.compile(br'\scoveredstatements="(\d+)"')
+
+# The encoding declared in the XML declaration, if any
+ENCODING = re.compile(br'<\?xml[^>]*\sencoding=["\']([^"\']*)["\']')
+
+
+class ScanError(Exception):
+
+    """
+    An exception raised when a coverage file doesn't have the shape the
+    scanner expects, so it should be parsed with ElementTree instead.
+    """
+
+    pass
+
+
+def scan(data):
+    """
+    Scans the bytes of a whole coverage file, returning a tuple for
+    each <file> element inside the <project> element: (name, lines,
+    covered, statements, good lines, bad lines). The line numbers are
+    arrays, exactly as FileCoverage.parse() would make them.
+
+    Only the strict subset of XML written by PHPUnit is understood;
+    raises ScanError for anything else, such as comments, CDATA, other
+    encodings, or attributes in an unexpected order.
+    """
+    check_document(data)
+
+    root = TAG.search(data)
+    if not root or not data.rstrip().endswith(b'</' + root.group(1) + b'>'):
+        raise ScanError("Incomplete coverage file")
+
+    # the <project> element must be a child of the root element
+    project = data.find(b'<project')
+    project_end = data.rfind(b'</project>')
+    if project == -1 or project_end == -1:
+        raise ScanError("No <project> element found")
+
+    tags = data.count(b'<', 0, project) - data.count(b'<?', 0, project)
+    if tags != 1 or data.find(b'<project', project + 1) != -1:
+        raise ScanError("Unexpected <project> element")
+
+    files = []
+    position = 0
+
+    while True:
+        start, tag_end, end = find_file(data, position)
+        if start == -1:
+            break
+
+        # files outside the project aren't coverage data
+        if start < project or end > project_end:
+            raise ScanError("<file> element outside <project> element")
+
+        filename = name(data[start + 5:tag_end - 1])
+        files.append(scan_file(filename, data, tag_end, end))
+        position = end + len(b'</file>')
+
+    return files
+
+
+def scan_element(data):
+    """
+    Scans the bytes of a single <file> element, returning a tuple in
+    the same form as scan().
+    """
+    check_document(data)
+
+    data = data.strip()
+    start, tag_end, end = find_file(data, 0)
+    if start != 0 or end + len(b'</file>') != len(data):
+        raise ScanError("Not a single <file> element")
+
+    filename = name(data[start + 5:tag_end - 1])
+    return scan_file(filename, data, tag_end, end)
+
+
+def find_file(data, position):
+    """
+    Finds the next <file> element from a position in the data,
+    returning the positions of its start, the end of its start tag,
+    and its end tag, or (-1, -1, -1) if there are no more.
+    """
+    start = data.find(b'<file', position)
+    if start == -1:
+        return -1, -1, -1
+
+    tag_end = data.find(b'>', start) + 1
+    if data[start + 5:start + 6] not in (b' ', b'\t', b'\r', b'\n'):
+        raise ScanError("Unexpected <file> element")
+
+    end = data.find(b'</file>', tag_end)
+    if tag_end == 0 or data[tag_end - 2:tag_end] == b'/>' or end == -1:
+        raise ScanError("Unexpected <file> element")
+
+    if data.find(b'<file', tag_end, end) != -1:
+        raise ScanError("Nested <file> elements")
+
+    return start, tag_end, end
+
+
+def scan_file(filename, data, start, end):
+    """
+    Scans the contents of a <file> element, between the start and end
+    positions in the data.
+    """
+    # the file's own metrics come after any <class> elements (which
+    # have metrics of their own), and after all of the lines
+    metrics = METRICS.findall(data, start, end)
+    if not metrics:
+        raise ScanError("No <metrics> element for %s" % filename)
+
+    classes = data.rfind(b'</class', start, end)
+    last_metrics = data.rfind(b'<metrics', start, end)
+    class_count = data.count(b'<class', start, end)
+    if last_metrics < classes or len(metrics) != class_count + 1:
+        raise ScanError("Unexpected <metrics> element for %s" % filename)
+
+    attributes = metrics[-1]
+    num_lines = metric(LOC, attributes)
+    covered = metric(COVERED, attributes)
+    statements = metric(STATEMENTS, attributes)
+
+    good = GOOD.findall(data, start, end)
+    bad = BAD.findall(data, start, end)
+    other = len(OTHER.findall(data, start, end))
+
+    # every <line>, and every other element, must be understood
+    lines = data.count(b'<line', start, end)
+    elements = (lines + len(metrics) + class_count +
+                data.count(b'</class', start, end))
+    if lines != len(good) + len(bad) + other:
+        raise ScanError("Unexpected <line> element for %s" % filename)
+    if data.count(b'<', start, end) != elements:
+        raise ScanError("Unexpected element for %s" % filename)
+
+    if lines and data.find(b'<line', start, end) < classes:
+        raise ScanError("<line> element inside <class> for %s" % filename)
+
+    return (
+        filename,
+        num_lines,
+        covered,
+        statements,
+        lines_array(good, num_lines),
+        lines_array(bad, num_lines),
+    )
+
+
+def lines_array(numbers, num_lines):
+    """
+    Converts line numbers (as bytes) to an array, skipping the same
+    quirks in the coverage data as FileCoverage.parse(): line #0, and
+    any lines greater than the number of lines in the file.
+    """
+    lines = array.array(LINE_TYPE, map(int, numbers))
+
+    if lines and (min(lines) == 0 or max(lines) > num_lines):
+        lines = array.array(
+            LINE_TYPE, [n for n in lines if 0 < n <= num_lines])
+
+    return lines
+
+
+def check_document(data):
+    """
+    Raises ScanError if the data contains anything which could change
+    how it's parsed, which the scanner doesn't understand.
+    """
+    if b'<!' in data:
+        raise ScanError("Comments, CDATA and DTDs aren't supported")
+
+    encoding = ENCODING.match(data.lstrip())
+    if encoding and encoding.group(1).lower() not in (b'utf-8', b'utf8'):
+        raise ScanError("Unsupported encoding")
+
+
+def name(tag):
+    """
+    Gets the name attribute from the attributes of a <file> start tag.
+    """
+    match = NAME.search(tag)
+    if not match:
+        raise ScanError("<file> element without a name")
+
+    value = match.group(1)
+
+    # let ElementTree decode entities and character references
+    if b'&' in value:
+        try:
+            tag = xml.etree.ElementTree.fromstring(b'<file' + tag + b'/>')
+        except xml.etree.ElementTree.ParseError:
+            raise ScanError("Invalid <file> start tag")
+
+        return tag.get('name')
+
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        raise ScanError("Invalid UTF-8 in file name")
+
+
+def metric(pattern, attributes):
+    """
+    Gets an integer metric from the attributes of a <metrics> tag.
+    """
+    match = pattern.search(attributes)
+    if not match:
+        raise ScanError("Missing metric")
+
+    return int(match.group(1))
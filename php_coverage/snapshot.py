@@ -0,0 +1,175 @@
+import array
+import mmap
+import os
+import struct
+import sys
+
+# Identifies snapshot files, including the version of the format
+MAGIC = b'PHPCOV\x00\x01'
+
+# Magic, report size, report mtime (ns), report inode, number of files
+HEADER = struct.Struct('<8sQqQI')
+
+# Name length, lines, statements, covered, good lines, bad lines
+RECORD = struct.Struct('<IIIIII')
+
+# Line numbers are stored as little-endian 32-bit unsigned integers
+LINE_TYPE = 'I'
+LINE_SIZE = 4
+
+
+def pack(lines):
+    """
+    Converts a sequence of line numbers to little-endian bytes.
+    """
+    data = array.array(LINE_TYPE, lines)
+    if sys.byteorder != 'little':
+        data.byteswap()
+
+    return data.tobytes() if hasattr(data, 'tobytes') else data.tostring()
+
+
+def unpack(data):
+    """
+    Converts little-endian bytes to an array of line numbers.
+    """
+    lines = array.array(LINE_TYPE)
+    if hasattr(lines, 'frombytes'):
+        lines.frombytes(data)
+    else:
+        lines.fromstring(data)
+
+    if sys.byteorder != 'little':
+        lines.byteswap()
+
+    return lines
+
+
+class Snapshot():
+
+    """
+    A compact binary copy of the parsed data in a coverage file.
+
+    The snapshot starts with a header containing the fingerprint of the
+    coverage file it was made from, so it can be ignored once the
+    coverage file changes. This is followed by a record for each file,
+    containing its name, metrics, and its good and bad line numbers.
+
+    Snapshots are read using mmap, and only the names and metrics are
+    read up-front. The line numbers for a file are only read when they
+    are requested using lines().
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.map = None
+        self.records = []
+
+    def open(self, fingerprint):
+        """
+        Opens the snapshot, reading its records. Returns False if the
+        snapshot doesn't exist, is invalid, or wasn't made from a
+        coverage file with the given fingerprint.
+        """
+        try:
+            with open(self.filename, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return False
+
+        try:
+            self.records = self.read(fingerprint)
+        except struct.error:
+            self.records = None
+
+        if self.records is None:
+            self.close()
+            return False
+
+        return True
+
+    def read(self, fingerprint):
+        """
+        Reads the records from the opened snapshot, or returns None if
+        it doesn't match the given fingerprint.
+        """
+        magic, size, mtime, inode, count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or (size, mtime, inode) != tuple(fingerprint):
+            return None
+
+        records = []
+        offset = HEADER.size
+
+        for _ in range(count):
+            fields = RECORD.unpack_from(self.map, offset)
+            length, num_lines, statements, covered, good, bad = fields
+            offset += RECORD.size
+
+            name = self.map[offset:offset + length].decode('utf-8')
+            offset += length
+
+            records.append(
+                (name, num_lines, covered, statements, offset, good, bad))
+            offset += (good + bad) * LINE_SIZE
+
+        if offset != len(self.map):
+            return None
+
+        return records
+
+    def lines(self, record):
+        """
+        Reads the good and bad line numbers for a record, returning
+        them as a tuple of two arrays.
+        """
+        offset, good, bad = record[4:]
+        middle = offset + good * LINE_SIZE
+
+        return (
+            unpack(self.map[offset:middle]),
+            unpack(self.map[middle:middle + bad * LINE_SIZE]),
+        )
+
+    def close(self):
+        """
+        Closes the snapshot's memory map.
+        """
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def write(self, fingerprint, files):
+        """
+        Writes a snapshot of a list of parsed FileCoverage objects,
+        made from a coverage file with the given fingerprint.
+
+        The snapshot is written to a temporary file first, and then
+        moved into place, so readers never see a partial snapshot.
+        """
+        size, mtime, inode = fingerprint
+        temp = '%s.%d.tmp' % (self.filename, os.getpid())
+
+        with open(temp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, size, mtime, inode, len(files)))
+
+            for coverage in files:
+                name = coverage.filename.encode('utf-8')
+                f.write(RECORD.pack(
+                    len(name),
+                    coverage.num_lines,
+                    coverage.statements,
+                    coverage.covered,
+                    len(coverage.good_lines),
+                    len(coverage.bad_lines),
+                ))
+                f.write(name)
+                f.write(pack(coverage.good_lines))
+                f.write(pack(coverage.bad_lines))
+
+        try:
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+            os.rename(temp, self.filename)
+        except OSError:
+            os.remove(temp)
+            raise
@@ -0,0 +1,201 @@
+import collections
+import functools
+import threading
+import time
+
+from php_coverage.config import config
+
+# Number of recent durations kept for each operation
+SAMPLES = 1000
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class NullTimer():
+
+    """
+    A timer which does nothing, used when instrumentation is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+null_timer = NullTimer()
+
+
+class Timer():
+
+    """
+    Records the duration of a with block as a sample of an operation.
+    """
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, *args):
+        self.stats.record(self.name, timer() - self.start)
+        return False
+
+
+class Stats():
+
+    """
+    Records how long operations take, and counts events, so the
+    plugin's performance can be inspected using the phpcoverage_stats
+    command.
+
+    The most recent durations for each operation are kept in a
+    fixed-size ring buffer, so memory usage stays the same however long
+    the plugin runs. The total number of samples is counted separately.
+
+    Instrumentation is controlled by the "stats" setting. When it's
+    disabled, timer() returns a shared do-nothing timer and count()
+    returns straight away, so instrumented code runs at almost the same
+    speed as uninstrumented code.
+    """
+
+    def __init__(self, size=SAMPLES):
+        self.size = size
+        self.enabled = False
+        self.samples = {}
+        self.totals = collections.Counter()
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    def configure(self):
+        """
+        Enables or disables instrumentation using the "stats" setting.
+        """
+        self.enabled = bool(config.get('stats', False))
+
+    def timer(self, name):
+        """
+        Gets a context manager which records the duration of a with
+        block as a sample of the named operation.
+        """
+        if not self.enabled:
+            return null_timer
+
+        return Timer(self, name)
+
+    def record(self, name, duration):
+        """
+        Records a duration (in seconds) for the named operation.
+        """
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = collections.deque(maxlen=self.size)
+                self.samples[name] = samples
+
+            samples.append(duration)
+            self.totals[name] += 1
+
+    def count(self, name, amount=1):
+        """
+        Counts occurrences of the named event.
+        """
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counts[name] += amount
+
+    def percentiles(self, name, percents=(50, 90, 99)):
+        """
+        Gets percentiles of the recent durations of the named operation,
+        as a dictionary mapping each percent to a duration in seconds.
+        Uses the nearest-rank method. Returns None if there are no
+        samples.
+        """
+        with self.lock:
+            samples = sorted(self.samples.get(name, ()))
+
+        if not samples:
+            return None
+
+        result = {}
+        for percent in percents:
+            rank = max(1, int(round(percent / 100.0 * len(samples))))
+            result[percent] = samples[min(rank, len(samples)) - 1]
+
+        return result
+
+    def summary(self):
+        """
+        Gets a summary of all the recorded statistics, as a list of
+        lines of text.
+        """
+        lines = ['%-24s %8s %10s %10s %10s %10s' % (
+            'Operation', 'Count', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)',
+            'Max (ms)')]
+
+        with self.lock:
+            names = sorted(self.samples)
+            totals = dict(self.totals)
+            counts = sorted(self.counts.items())
+
+        for name in names:
+            values = self.percentiles(name, (50, 90, 99, 100))
+            lines.append('%-24s %8d %10.3f %10.3f %10.3f %10.3f' % (
+                name,
+                totals[name],
+                values[50] * 1000,
+                values[90] * 1000,
+                values[99] * 1000,
+                values[100] * 1000,
+            ))
+
+        if counts:
+            lines.append('')
+            lines.append('%-24s %8s' % ('Event', 'Count'))
+            for name, count in counts:
+                lines.append('%-24s %8d' % (name, count))
+
+        if not self.enabled:
+            lines.append('')
+            lines.append('Set "stats" to true in the settings to collect '
+                         'statistics.')
+
+        return lines
+
+    def clear(self):
+        """
+        Forgets all of the recorded statistics.
+        """
+        with self.lock:
+            self.samples.clear()
+            self.totals.clear()
+            self.counts.clear()
+
+
+stats = Stats()
+config.add_listener(stats.configure)
+
+
+def timed(name):
+    """
+    Decorates a function so each call is recorded as a sample of the
+    named operation in the shared Stats.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not stats.enabled:
+                return function(*args, **kwargs)
+
+            with Timer(stats, name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -9,11 +9,20 @@ class PollingThread(threading.Thread):
 
     Override the poll() method in a subclass to define the behaviour of
     each "poll" event, which happens every self.tick() seconds.
+
+    The tick adapts to activity: if poll() returns False (meaning
+    nothing happened), the tick is doubled, up to max_tick seconds. As
+    soon as poll() returns True, the tick goes back to min_tick
+    seconds. If poll() returns None, the tick is left as it is. By
+    default, max_tick is the same as min_tick, so the tick is fixed.
     """
 
-    def __init__(self):
+    def __init__(self, min_tick=None, max_tick=None):
         super(PollingThread, self).__init__()
         self.stop_event = threading.Event()
+        self.min_tick = min_tick
+        self.max_tick = max_tick
+        self.interval = None
 
     def stop(self, timeout=None):
         """
@@ -26,11 +35,43 @@ class PollingThread(threading.Thread):
         if self.is_alive():
             raise Timeout("Timeout waiting for PollingThread to stop")
 
+    def get_min_tick(self):
+        """
+        Gets the shortest timeout between polls, in seconds.
+        """
+        if self.min_tick is None:
+            return 0.1  # seconds
+
+        return self.min_tick
+
+    def get_max_tick(self):
+        """
+        Gets the longest timeout between polls, in seconds.
+        """
+        if self.max_tick is None:
+            return self.get_min_tick()
+
+        return max(self.max_tick, self.get_min_tick())
+
     def tick(self):
         """
         The timeout between polls, in seconds.
         """
-        return 0.1  # seconds
+        if self.interval is None:
+            return self.get_min_tick()
+
+        return self.interval
+
+    def adapt(self, active):
+        """
+        Adjusts the tick after a poll: back to the shortest tick if the
+        poll found activity, or doubled (up to the longest tick) if it
+        didn't.
+        """
+        if active:
+            self.interval = None
+        elif active is not None:
+            self.interval = min(self.tick() * 2, self.get_max_tick())
 
     def run(self):
         """
@@ -40,20 +81,30 @@ class PollingThread(threading.Thread):
         If not, it calls self.poll() and resumes waiting again.
         """
         while True:
-            # Effectively the same as time.sleep(self.tick()), but if
-            # the stop event gets set, the thread wakes up immediately
-            self.stop_event.wait(timeout=self.tick())
+            self.wait(self.tick())
 
             # Terminate the method (and thread) if stop flag is set
             if (self.stop_event.is_set()):
                 return
 
             # Delegate polling behaviour to subclass' poll() method
-            self.poll()
+            self.adapt(self.poll())
+
+    def wait(self, timeout):
+        """
+        Waits for up to timeout seconds before the next poll.
+
+        Effectively the same as time.sleep(timeout), but if the stop
+        event gets set, the thread wakes up immediately. Override in a
+        subclass to wait for something other than a timeout.
+        """
+        self.stop_event.wait(timeout=timeout)
 
     def poll(self):
         """
-        Override in subclass to define polling behaviour
+        Override in subclass to define polling behaviour. Return True
+        or False to say whether there was any activity, to adapt the
+        tick to it.
         """
         raise NotImplementedError("poll() should be overridden")
 
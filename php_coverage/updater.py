@@ -1,40 +1,238 @@
+import array
+import bisect
 import os
 import sublime
+import threading
 import xml.etree.ElementTree
 
+from php_coverage.config import config
 from php_coverage.debug import debug_message
+from php_coverage.stats import stats, timed
+
+# Region keys, with the scope and icon for each
+REGIONS = [
+    ('SublimePHPCoverageGood', 'markup.inserted', 'dot'),
+    ('SublimePHPCoverageBad', 'markup.deleted', 'bookmark'),
+]
+
+STATUS = 'SublimePHPCoveragePercentage'
+
+# Key for the ranges of lines annotated in viewport mode
+VIEWPORT = 'viewport'
+
+
+class AppliedCoverage():
+
+    """
+    Remembers the coverage last shown in each view, keyed by view ID,
+    so that ViewUpdaters can tell what has changed since.
+
+    For each view, the view's change count is stored along with the
+    line numbers for each region key and the status text. Once the
+    view has been edited, the regions may have moved, so everything is
+    treated as changed. The FileCoverage shown is also kept, so a view
+    in viewport mode can be annotated further as it's scrolled.
+    """
+
+    def __init__(self):
+        self.views = {}
+        self.lock = threading.Lock()
+
+    def get(self, view):
+        """
+        Gets the coverage last shown in a view, as a dictionary mapping
+        region keys (and the status key) to their values, or None if
+        it's unknown.
+        """
+        with self.lock:
+            record = self.views.get(view.id(), (None, None, None))
+
+        change_count, shown, coverage = record
+        if change_count != view.change_count():
+            return None
+
+        return shown
+
+    def get_coverage(self, view):
+        """
+        Gets a tuple of the FileCoverage last shown in a view, and the
+        dictionary describing how it was shown, even if the view has
+        been edited since. Returns (None, None) if it's unknown.
+        """
+        with self.lock:
+            record = self.views.get(view.id(), (None, None, None))
+
+        return record[2], record[1]
+
+    def set(self, view, shown, coverage=None):
+        """
+        Remembers the coverage shown in a view.
+        """
+        with self.lock:
+            self.views[view.id()] = (view.change_count(), shown, coverage)
+
+    def forget(self, view):
+        """
+        Forgets the coverage shown in a view, such as when it's closed.
+        """
+        with self.lock:
+            self.views.pop(view.id(), None)
+
+
+applied = AppliedCoverage()
 
 
 class ViewUpdater():
 
     """
     Handles updating the coverage data shown in a particular view.
+
+    Only the regions and status which differ from those last shown in
+    the view (as remembered by an AppliedCoverage, by default the
+    shared one) are redrawn, so updating a view with unchanged coverage
+    doesn't touch it at all.
+
+    When a file has more lines than the "viewport_threshold" setting,
+    only the lines visible in the view, plus "viewport_margin" lines
+    either side, are annotated. Call refresh() as the view is scrolled
+    to annotate the newly visible lines. The lines already annotated
+    stay annotated, until the coverage changes or the view is edited.
     """
 
+    def __init__(self, applied=None):
+        self.applied = applied
+
+    def get_applied(self):
+        """
+        Gets the AppliedCoverage for the updater. If none is set, the
+        shared one is used.
+        """
+        return self.applied or applied
+
+    @timed('updater.update')
     def update(self, view, coverage=None):
         """
         Updates a view with the coverage data in a particular file
         """
-        self.remove(view)
+        shown = self.get_applied().get(view)
+        viewports = self.viewports(view, coverage, shown)
+        wanted = self.describe(coverage, viewports)
 
-        if not coverage:
+        if shown == wanted:
+            debug_message('Coverage unchanged for view %d', view.id())
+            stats.count('updater.unchanged')
             return
 
-        self.annotate_lines(
-            view=view,
-            name='SublimePHPCoverageGood',
-            lines=coverage.good_lines,
-            scope='markup.inserted',
-            icon='dot',
-        )
-
-        self.annotate_lines(
-            view=view,
-            name='SublimePHPCoverageBad',
-            lines=coverage.bad_lines,
-            scope='markup.deleted',
-            icon='bookmark',
-        )
+        for name, scope, icon in REGIONS:
+            lines = wanted.get(name)
+
+            if shown is not None and shown.get(name) == lines:
+                continue
+
+            if lines:
+                self.annotate_lines(
+                    view=view,
+                    name=name,
+                    lines=lines,
+                    scope=scope,
+                    icon=icon,
+                )
+            else:
+                view.erase_regions(name)
+
+        status = wanted.get(STATUS)
+        if shown is None or shown.get(STATUS) != status:
+            if status:
+                debug_message(status)
+                view.set_status(STATUS, status)
+            else:
+                view.erase_status(STATUS)
+
+        self.get_applied().set(view, wanted, coverage)
+
+    def refresh(self, view):
+        """
+        Annotates more of a view in viewport mode, if the lines visible
+        in it are no longer all annotated.
+        """
+        coverage, shown = self.get_applied().get_coverage(view)
+        if not shown or not shown.get(VIEWPORT):
+            return
+
+        visible_first, visible_last = self.visible_lines(view)
+
+        for first, last in shown[VIEWPORT]:
+            if first <= visible_first and visible_last <= last:
+                return
+
+        debug_message('Annotating lines %d-%d of view %d',
+                      visible_first, visible_last, view.id())
+        self.update(view, coverage)
+
+    def viewport(self, view, coverage=None):
+        """
+        Gets the range of lines to annotate in viewport mode, as a tuple
+        of the first and last line numbers, or None to annotate all of
+        the lines.
+        """
+        threshold = config.get('viewport_threshold')
+        if not coverage or threshold is None:
+            return None
+
+        if coverage.num_lines <= threshold:
+            return None
+
+        margin = config.get('viewport_margin', 100)
+        first, last = self.visible_lines(view)
+        return (max(1, first - margin), last + margin)
+
+    def viewports(self, view, coverage, shown):
+        """
+        Gets the ranges of lines to annotate in viewport mode, as a list
+        of (first, last) tuples, or None to annotate all of the lines.
+
+        The current viewport is added to the ranges already shown, as
+        long as the same coverage is shown and the view hasn't been
+        edited, so scrolling back doesn't annotate the lines again.
+        """
+        viewport = self.viewport(view, coverage)
+        if viewport is None:
+            return None
+
+        ranges = [viewport]
+        if shown and shown.get(VIEWPORT):
+            if self.get_applied().get_coverage(view)[0] is coverage:
+                ranges.extend(shown[VIEWPORT])
+
+        return union(ranges)
+
+    def visible_lines(self, view):
+        """
+        Gets the first and last line numbers visible in a view.
+        """
+        visible = view.visible_region()
+        first = view.rowcol(visible.begin())[0] + 1
+        last = view.rowcol(visible.end())[0] + 1
+        return first, last
+
+    def describe(self, coverage=None, viewports=None):
+        """
+        Describes how coverage data should be shown, as a dictionary
+        mapping each region key to its line numbers, and the status key
+        to the status text. Returns an empty dictionary for no coverage.
+
+        If viewports are given, as a list of tuples of the first and
+        last line numbers, only line numbers within them are included.
+        """
+        if not coverage:
+            return {}
+
+        good_lines = coverage.get('_good_lines')
+        bad_lines = coverage.get('_bad_lines')
+
+        if viewports:
+            good_lines = clip(good_lines, viewports)
+            bad_lines = clip(bad_lines, viewports)
 
         try:
             percentage = 100 * coverage.covered / float(coverage.statements)
@@ -43,19 +241,103 @@ class ViewUpdater():
 
         status = '%d/%d lines (%.2f%%)' % (
             coverage.covered, coverage.statements, percentage)
-        debug_message('Code coverage: %s' % status)
-        view.set_status(
-            'SublimePHPCoveragePercentage', 'Code coverage: %s' % status)
+
+        return {
+            'SublimePHPCoverageGood': good_lines.tolist(),
+            'SublimePHPCoverageBad': bad_lines.tolist(),
+            STATUS: 'Code coverage: %s' % status,
+            VIEWPORT: viewports,
+        }
 
     def remove(self, view):
         view.erase_regions('SublimePHPCoverageBad')
         view.erase_regions('SublimePHPCoverageGood')
-        view.erase_status('SublimePHPCoveragePercentage')
+        view.erase_status(STATUS)
+        self.get_applied().forget(view)
 
     def annotate_lines(self, view=None, name=None, lines=[], scope=None, icon=None, **kwargs):
+        """
+        Adds regions for a list of line numbers to a view.
+
+        Consecutive line numbers are merged into runs, and the regions
+        for all the lines in a run are found with a single call to
+        view.lines(). Each line still gets a region of its own, as the
+        gutter icon is only drawn on the first line of a region. Every
+        region covers its line without the trailing newline, whether
+        or not the line is part of a longer run.
+        """
         regions = []
-        for line in lines:
-            regions.append(view.full_line(view.text_point(line - 1, 0)))
+        for first, last in runs(lines):
+            start = view.text_point(first - 1, 0)
+            end = view.text_point(last - 1, 0)
+
+            if first == last:
+                regions.append(view.line(start))
+            else:
+                span = sublime.Region(start, view.line(end).end())
+                regions.extend(view.lines(span))
 
         if len(regions) > 0:
             view.add_regions(name, regions, scope, icon, sublime.HIDDEN)
+
+
+def within(lines, first, last):
+    """
+    Gets the line numbers from a sorted array which are between first
+    and last (inclusive), using a binary search.
+    """
+    start = bisect.bisect_left(lines, first)
+    end = bisect.bisect_right(lines, last, start)
+    return lines[start:end]
+
+
+def clip(lines, ranges):
+    """
+    Gets the line numbers from a sorted array which are within any of
+    a sorted list of non-overlapping (first, last) ranges.
+    """
+    result = array.array(lines.typecode)
+    for first, last in ranges:
+        result.extend(within(lines, first, last))
+
+    return result
+
+
+def union(ranges):
+    """
+    Merges (first, last) ranges of line numbers which overlap or are
+    adjacent, returning a sorted list of ranges.
+    """
+    result = []
+
+    for first, last in sorted(ranges):
+        if result and first <= result[-1][1] + 1:
+            result[-1] = (result[-1][0], max(result[-1][1], last))
+        else:
+            result.append((first, last))
+
+    return result
+
+
+def runs(lines):
+    """
+    Merges line numbers into runs of consecutive lines, returning a
+    list of (first, last) tuples in ascending order. Duplicate line
+    numbers are ignored.
+    """
+    result = []
+    first = last = None
+
+    for line in sorted(lines):
+        if last is not None and line <= last + 1:
+            last = max(last, line)
+            continue
+
+        if last is not None:
+            result.append((first, last))
+        first = last = line
+
+    if last is not None:
+        result.append((first, last))
+
+    return result
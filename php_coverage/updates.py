@@ -0,0 +1,122 @@
+import collections
+import threading
+import traceback
+
+from php_coverage.debug import debug_message
+
+# Priorities of views, lowest first
+ACTIVE = 0
+VISIBLE = 1
+HIDDEN = 2
+
+
+def view_priority(view):
+    """
+    Gets the priority of updating a view: ACTIVE for the view the user
+    is looking at, VISIBLE for views shown in any group of any window,
+    and HIDDEN for the rest.
+    """
+    import sublime
+
+    window = view.window()
+    if window is None:
+        return HIDDEN
+
+    active = sublime.active_window()
+    active_view = window.active_view()
+    if (active is not None and active.id() == window.id() and
+            active_view is not None and active_view.id() == view.id()):
+        return ACTIVE
+
+    for group in range(window.num_groups()):
+        visible = window.active_view_in_group(group)
+        if visible is not None and visible.id() == view.id():
+            return VISIBLE
+
+    return HIDDEN
+
+
+class UpdateQueue():
+
+    """
+    Collects pending updates to views, and applies them together in a
+    single pass in Sublime's async thread.
+
+    Only the latest update added for each view is kept, so if coverage
+    data changes several times before the queue is flushed, each view
+    is only updated once, with the newest data. When the queue is
+    flushed, the active view is updated first, followed by any other
+    visible views, and then the rest.
+    """
+
+    def __init__(self, set_timeout=None, priority=None):
+        self.set_timeout = set_timeout
+        self.priority = priority
+        self.pending = collections.OrderedDict()
+        self.scheduled = False
+        self.lock = threading.Lock()
+
+    def get_set_timeout(self):
+        """
+        Gets the function used to schedule a flush of the queue. If
+        none is set, Sublime's set_timeout_async is used.
+        """
+        if not self.set_timeout:
+            from php_coverage.helper import set_timeout_async
+            self.set_timeout = set_timeout_async
+
+        return self.set_timeout
+
+    def get_priority(self):
+        """
+        Gets the function used to find the priority of a view. If none
+        is set, view_priority() is used.
+        """
+        return self.priority or view_priority
+
+    def add(self, view, update):
+        """
+        Adds an update for a view, which is a function to be called
+        (without arguments) when the queue is flushed. Replaces any
+        pending update for the same view.
+        """
+        with self.lock:
+            self.pending.pop(view.id(), None)
+            self.pending[view.id()] = (view, update)
+
+            if self.scheduled:
+                return
+
+            self.scheduled = True
+
+        self.get_set_timeout()(self.flush, 1)
+
+    def discard(self, view):
+        """
+        Removes any pending update for a view, such as when it's closed.
+        """
+        with self.lock:
+            self.pending.pop(view.id(), None)
+
+    def flush(self):
+        """
+        Applies all pending updates, in order of priority.
+        """
+        with self.lock:
+            pending = list(self.pending.values())
+            self.pending.clear()
+            self.scheduled = False
+
+        priority = self.get_priority()
+        pending.sort(key=lambda item: priority(item[0]))
+
+        debug_message("[UpdateQueue] Applying %d updates", len(pending))
+
+        for view, update in pending:
+            try:
+                update()
+            except Exception:
+                traceback.print_exc()
+
+
+queue = UpdateQueue()
@@ -1,19 +1,54 @@
+import glob
 import hashlib
 import os
+import threading
+import time
+import traceback
 
+from php_coverage import finder
+from php_coverage import inotify
+from php_coverage.config import config
 from php_coverage.data import CoverageDataFactory
+from php_coverage.data import fingerprint
 from php_coverage.debug import debug_message
+from php_coverage.stats import timed
 from php_coverage.thread import PollingThread
 
 # Chunk size used to read file in
 CHUNK_SIZE = 1024 * 1024
 
+# Size of each of the blocks read to make a sampled digest of a file
+SAMPLE_SIZE = 64 * 1024
 
-class FileWatcher(PollingThread):
+# Default time a changed file must be stable for before it's reported
+SETTLE_TIME = 1.0
+
+# Default shortest and longest times between polls of watched files
+POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 2.0
+
+
+class FileWatcher(object):
 
     """
     Watches a file for changes, calling a callback every time the file
     is modified.
+
+    Files are often written over a period of time, so changes are only
+    reported once the file has settled: when its size and modification
+    time have stayed the same for self.settle_time seconds (taken from
+    the "settle_time" setting), or straight away if self.complete()
+    determines the file is completely written.
+
+    To tell whether a file's content has changed, it's fingerprinted in
+    tiers. The file's size, modification time and inode are checked on
+    every poll. Only if those change is a digest of a few sampled
+    blocks of the file taken, and only if the "full_hash" setting is
+    enabled is the whole file hashed as well.
+
+    FileWatchers don't have a thread of their own. Once started, the
+    file is checked for changes by poll(), which is called from the
+    single WatcherScheduler thread shared by all FileWatchers.
     """
 
     CREATED = 'created'      # didn't exist before, does now
@@ -22,8 +57,11 @@ class FileWatcher(PollingThread):
     UNCHANGED = 'unchanged'  # mtime changed, same content
 
     def __init__(self, filename):
-        super(FileWatcher, self).__init__()
         self.filename = filename
+        self.scheduler = None
+        self.settle_time = config.get('settle_time', SETTLE_TIME)
+        self.full_hash = config.get('full_hash', False)
+        self.settling = None
         self.callbacks = {
             self.CREATED: {},
             self.DELETED: {},
@@ -75,11 +113,11 @@ class FileWatcher(PollingThread):
         """
         callbacks = self.callbacks[event]
 
-        debug_message("[FileWatcher] %s '%s'" % (event, self.filename))
-        debug_message("[FileWatcher] %d callbacks" % len(callbacks))
+        debug_message("[FileWatcher] %s '%s'", event, self.filename)
+        debug_message("[FileWatcher] %d callbacks", len(callbacks))
 
         for callback in callbacks.values():
-            debug_message("[FileWatcher] Calling %s" % repr(callback))
+            debug_message("[FileWatcher] Calling %r", callback)
             callback()
 
     def hash(self):
@@ -100,51 +138,403 @@ class FileWatcher(PollingThread):
 
         return sha1.digest()
 
-    def mtime(self):
+    def sample(self, state):
         """
-        Gets the last modified time of the file referred to by
-        self.filename. Returns None if the file doesn't exist.
+        Gets a digest of blocks sampled from the start, middle and end
+        of the file, along with its size. Small files are read in full.
+        Returns None if the file doesn't exist.
         """
-        if not os.path.exists(self.filename):
+        if state is None:
             return None
 
-        return os.path.getmtime(self.filename)
+        size = state[0]
+        sha1 = hashlib.sha1(str(size).encode('ascii'))
+
+        try:
+            with open(self.filename, 'rb') as f:
+                if size <= SAMPLE_SIZE * 3:
+                    sha1.update(f.read())
+                else:
+                    for offset in (0, size // 2, size - SAMPLE_SIZE):
+                        f.seek(offset)
+                        sha1.update(f.read(SAMPLE_SIZE))
+        except (IOError, OSError):
+            return None
+
+        return sha1.digest()
+
+    @timed('watcher.digest')
+    def digest(self, state):
+        """
+        Gets the digest used to determine whether the file's content
+        has changed: the sampled digest, plus the full hash if the
+        "full_hash" setting is enabled.
+        """
+        digest = self.sample(state)
+        if digest is None or not self.full_hash:
+            return digest
+
+        full = self.hash()
+        return None if full is None else digest + full
+
+    def complete(self):
+        """
+        Determines whether the file is known to be completely written.
+        Override in a subclass for files with a recognisable ending.
+        """
+        return False
+
+    def settled(self, state):
+        """
+        Determines whether a changed file has finished being written.
+
+        The first time the file is seen in a new state, the time is
+        recorded, and the file is considered settled once it's been in
+        the same state for self.settle_time seconds.
+        """
+        if self.settle_time <= 0 or self.complete():
+            self.settling = None
+            return True
+
+        now = time.time()
+
+        if self.settling is None or self.settling[0] != state:
+            self.settling = (state, now)
+            return False
+
+        if now - self.settling[1] < self.settle_time:
+            return False
+
+        self.settling = None
+        return True
 
     def start(self):
-        self.last_mtime = self.mtime()
-        self.last_hash = self.hash()
-        if self.last_mtime:
-            debug_message("[FileWatcher] exists: %s" % self.filename)
+        """
+        Starts watching the file, by adding this watcher to the shared
+        WatcherScheduler thread.
+        """
+        self.scheduler = get_scheduler()
+        self.scheduler.add(self)
+
+    def reset(self):
+        """
+        Records the current state of the file, which later polls are
+        compared against. Only the sampled digest is taken here, unless
+        the "full_hash" setting is enabled, in which case the whole file
+        is read and hashed as well.
+        """
+        self.last_state = fingerprint(self.filename)
+        self.last_digest = self.digest(self.last_state)
+        if self.last_state:
+            debug_message("[FileWatcher] exists: %s", self.filename)
         else:
-            debug_message("[FileWatcher] doesn't exist: %s" % self.filename)
-        super(FileWatcher, self).start()
+            debug_message("[FileWatcher] doesn't exist: %s", self.filename)
+
+    def stop(self, timeout=None):
+        """
+        Stops watching the file. This doesn't block, as the watcher has
+        no thread of its own to wait for; the timeout parameter is only
+        accepted for compatibility.
+        """
+        if self.scheduler:
+            self.scheduler.remove(self)
+            self.scheduler = None
 
+    def is_alive(self):
+        """
+        Determines whether the watcher has been started (and not yet
+        stopped).
+        """
+        return self.scheduler is not None
+
+    @timed('watcher.poll')
     def poll(self):
         """
-        Checks the modified time of the file and dispatches events
-        representing any changes to it.
+        Checks the size, modified time and inode of the file and
+        dispatches events representing any changes to it. Returns True
+        if the file has changed at all since the last event, or False
+        if it hasn't.
         """
-        new_mtime = self.mtime()
+        new_state = fingerprint(self.filename)
 
         # if unchanged, do nothing
-        if self.last_mtime == new_mtime:
-            return
-
-        new_hash = self.hash()
-
-        # otherwise dispatch the corresponding event
-        if not self.last_mtime:
-            self.dispatch(self.CREATED)
-        elif not new_mtime:
-            self.dispatch(self.DELETED)
-        elif self.last_hash != new_hash:
-            self.dispatch(self.MODIFIED)
+        if self.last_state == new_state:
+            self.settling = None
+            return False
+
+        # deletions are reported straight away, other changes once
+        # the file has finished being written
+        if new_state and not self.settled(new_state):
+            return True
+
+        new_digest = self.digest(new_state)
+
+        # otherwise find the corresponding event
+        if not self.last_state:
+            event = self.CREATED
+        elif not new_state:
+            event = self.DELETED
+        elif self.last_state[0] != new_state[0]:
+            event = self.MODIFIED
+        elif self.last_digest != new_digest:
+            event = self.MODIFIED
         else:
-            self.dispatch(self.UNCHANGED)
+            event = self.UNCHANGED
+
+        # save new state before dispatching, so a failing callback
+        # can't cause the same event to be dispatched on every poll
+        self.last_state = new_state
+        self.last_digest = new_digest
+        self.dispatch(event)
+        return True
+
+
+class WatcherScheduler(PollingThread):
+
+    """
+    A single thread which polls every started FileWatcher, so the
+    number of threads stays the same however many files are watched.
+
+    Where inotify is available (and the "watch_backend" setting isn't
+    "polling"), the thread sleeps until inotify reports activity on one
+    of the watched files, and only polls the watchers for those files.
+    Watchers whose files can't be watched using inotify are polled
+    every self.tick() seconds instead, as are watchers waiting for a
+    changed file to settle.
+
+    The tick starts at the "poll_interval" setting, and doubles every
+    time a poll finds no changes, up to the "max_poll_interval"
+    setting. It goes back to "poll_interval" as soon as a change is
+    found, or a watcher is added.
+    """
+
+    def __init__(self):
+        super(WatcherScheduler, self).__init__()
+        self.name = 'WatcherScheduler'
+        self.daemon = True
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.watchers = []
+        self.polled = set()
+        self.pending = set()
+        self.settling = set()
+        self.backend = self.create_backend()
+
+    def create_backend(self):
+        """
+        Creates the inotify backend used to wait for changes to files.
+        Returns None if files should be polled instead.
+        """
+        if config.get('watch_backend', 'auto') == 'polling':
+            return None
+
+        if not inotify.available():
+            return None
+
+        try:
+            return inotify.InotifyBackend()
+        except OSError as e:
+            debug_message("[WatcherScheduler] inotify unavailable: %s", e)
+            return None
+
+    def get_min_tick(self):
+        """
+        Gets the shortest time between polls, from the "poll_interval"
+        setting.
+        """
+        return config.get('poll_interval', POLL_INTERVAL)
+
+    def get_max_tick(self):
+        """
+        Gets the longest time between polls, from the
+        "max_poll_interval" setting.
+        """
+        return max(config.get('max_poll_interval', MAX_POLL_INTERVAL),
+                   self.get_min_tick())
+
+    def add(self, watcher):
+        """
+        Starts polling a FileWatcher. The watcher's initial state is
+        recorded after the file is being watched, so that no changes
+        can be missed in between.
+        """
+        path = os.path.abspath(watcher.filename)
+
+        with self.lock:
+            if path not in self.polled and not self.is_watching(path):
+                self.watch(path)
+
+        watcher.reset()
+
+        with self.lock:
+            self.watchers.append(watcher)
+            self.interval = None
+
+        self.wake()
+
+    def watch(self, path):
+        """
+        Starts watching a path using the backend, falling back to
+        polling it if that's not possible. Glob patterns can't be
+        watched by the backend, so they're always polled.
+        """
+        if self.backend and not finder.is_pattern(path):
+            try:
+                self.backend.add(path)
+                return
+            except OSError as e:
+                debug_message("[WatcherScheduler] Polling %s: %s", path, e)
+
+        self.polled.add(path)
+
+    def is_watching(self, path):
+        """
+        Determines whether any watcher is already watching a path.
+        """
+        for watcher in self.watchers:
+            if os.path.abspath(watcher.filename) == path:
+                return True
+
+        return False
+
+    def remove(self, watcher):
+        """
+        Stops polling a FileWatcher.
+        """
+        with self.lock:
+            if watcher not in self.watchers:
+                return
+
+            self.watchers.remove(watcher)
+            path = os.path.abspath(watcher.filename)
+
+            if not self.is_watching(path):
+                self.polled.discard(path)
+                if self.backend:
+                    self.backend.remove(path)
+
+    def wake(self):
+        """
+        Wakes the thread up if it's waiting.
+        """
+        self.wake_event.set()
+        if self.backend:
+            self.backend.wake()
+
+    def stop(self, timeout=None):
+        """
+        Stops the thread, blocking until it terminates.
+        """
+        self.stop_event.set()
+        self.wake()
+        super(WatcherScheduler, self).stop(timeout)
 
-        # save new mtime for next poll
-        self.last_mtime = new_mtime
-        self.last_hash = new_hash
+    def wait(self, timeout):
+        """
+        Waits until a watched file may have changed. If any files need
+        to be polled, waits for no longer than timeout seconds. Being
+        woken up by wake() doesn't cut the wait short, so files are
+        never polled more often than every timeout seconds.
+        """
+        deadline = time.time() + timeout
+
+        while not self.stop_event.is_set():
+            with self.lock:
+                if self.pending:
+                    return
+                polling = bool(self.polled or self.settling)
+
+            remaining = deadline - time.time()
+            if polling and remaining <= 0:
+                return
+
+            if self.backend:
+                changed, broken = self.backend.wait(
+                    remaining if polling else None)
+
+                with self.lock:
+                    self.pending.update(changed)
+                    self.polled.update(broken)
+            else:
+                self.wake_event.wait(remaining if polling else None)
+                self.wake_event.clear()
+
+            # start a full tick if there was nothing to poll until now
+            if not polling:
+                deadline = time.time() + timeout
+
+    def poll(self):
+        """
+        Polls the watchers whose files may have changed, and any which
+        need to be polled on every tick. Returns True if any of their
+        files had changed.
+        """
+        with self.lock:
+            due = self.pending | self.polled | self.settling
+            self.pending = set()
+            self.settling = set()
+            watchers = list(self.watchers)
+
+        active = False
+
+        for watcher in watchers:
+            path = os.path.abspath(watcher.filename)
+            if path not in due:
+                continue
+
+            # one failing watcher mustn't stop the others being polled
+            try:
+                if watcher.poll():
+                    active = True
+            except Exception:
+                debug_message(traceback.format_exc())
+
+            # keep polling files which haven't settled yet
+            if watcher.settling is not None:
+                with self.lock:
+                    self.settling.add(path)
+
+        return active
+
+    def run(self):
+        """
+        Runs the thread, releasing the backend when it stops.
+        """
+        try:
+            super(WatcherScheduler, self).run()
+        finally:
+            if self.backend:
+                self.backend.close()
+
+
+scheduler = None
+scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Gets the shared WatcherScheduler, starting it if necessary.
+    """
+    global scheduler
+
+    with scheduler_lock:
+        if scheduler is None or scheduler.stop_event.is_set():
+            scheduler = WatcherScheduler()
+            scheduler.start()
+
+        return scheduler
+
+
+def stop_scheduler(timeout=None):
+    """
+    Stops the shared WatcherScheduler, if it's running.
+    """
+    global scheduler
+
+    with scheduler_lock:
+        if scheduler is not None:
+            scheduler.stop(timeout)
+            scheduler = None
 
 
 class CoverageWatcher(FileWatcher):
@@ -152,11 +542,21 @@ class CoverageWatcher(FileWatcher):
     """
     A FileWatcher which looks for changes to a coverage file, and
     passes extra coverage-related data to the event callbacks.
+
+    Callbacks can be registered along with the source file they're
+    interested in. Nothing is parsed when an event is dispatched, as
+    that would hold up the thread polling every watched file. Instead,
+    whoever applies the coverage data passed to a callback can call
+    changed() first, to compare the coverage data for its source file
+    with the coverage data last applied for that callback, and skip it
+    if it's the same.
     """
 
     def __init__(self, filename, coverage_factory=None):
         super(CoverageWatcher, self).__init__(filename)
         self.coverage_factory = coverage_factory
+        self.sources = {}
+        self.delivered = {}
 
     def get_coverage_factory(self):
         """
@@ -169,6 +569,49 @@ class CoverageWatcher(FileWatcher):
 
         return self.coverage_factory
 
+    def add_callback(self, events, id, callback, source=None):
+        """
+        Adds a new callback function for particular events. If source
+        is given, changed() compares the coverage data for that source
+        file.
+        """
+        super(CoverageWatcher, self).add_callback(events, id, callback)
+        if source is not None:
+            self.sources[id] = source
+
+    def remove_callback(self, id):
+        """
+        Removes an existing callback for particular events.
+        """
+        super(CoverageWatcher, self).remove_callback(id)
+        self.sources.pop(id, None)
+        self.delivered.pop(id, None)
+
+    def changed(self, id, data):
+        """
+        Determines whether the coverage data for the source file of the
+        callback with the given id differs from the coverage data last
+        passed to changed() for that callback, then remembers the data
+        for next time. This parses the coverage data if necessary, so
+        it should be called from the thread applying the data.
+        """
+        source = self.sources.get(id)
+        previous = self.delivered.get(id)
+
+        if source is None or previous is None:
+            result = True
+        else:
+            result = not data.reuse(previous, source)
+
+        self.delivered[id] = data
+        return result
+
+    def complete(self):
+        """
+        Determines whether the coverage file is completely written.
+        """
+        return complete(self.filename)
+
     def dispatch(self, event):
         """
         Dispatches an event, calling all relevant callbacks.
@@ -178,11 +621,151 @@ class CoverageWatcher(FileWatcher):
         """
         callbacks = self.callbacks[event]
 
-        debug_message("[CoverageWatcher] %s '%s'" % (event, self.filename))
-        debug_message("[CoverageWatcher] %d callbacks" % len(callbacks))
+        debug_message("[CoverageWatcher] %s '%s'", event, self.filename)
+        debug_message("[CoverageWatcher] %d callbacks", len(callbacks))
+
+        # the coverage file appearing or disappearing changes which
+        # coverage file should be found for source files
+        if event in (self.CREATED, self.DELETED):
+            finder.cache.invalidate(self.filename)
 
         data = self.get_coverage_factory().factory(self.filename)
 
-        for callback in callbacks.values():
-            debug_message("[CoverageWatcher] Calling %s" % repr(callback))
+        for id, callback in list(callbacks.items()):
+            debug_message("[CoverageWatcher] Calling %r", callback)
             callback(data)
+
+
+class ShardWatcher(FileWatcher):
+
+    """
+    A FileWatcher for one of the coverage files (shards) matching the
+    pattern watched by a ShardedCoverageWatcher.
+    """
+
+    def complete(self):
+        """
+        Determines whether the shard is completely written.
+        """
+        return complete(self.filename)
+
+
+class ShardedCoverageWatcher(CoverageWatcher):
+
+    """
+    A CoverageWatcher for a glob pattern matching several coverage
+    files (shards), such as those written by each worker of a parallel
+    test run.
+
+    Each shard is watched independently by a ShardWatcher of its own,
+    with its own fingerprint, digest and settling time, so a change to
+    one shard only causes that shard to be read again. The pattern is
+    matched again on every poll, to find any new shards.
+
+    Once every changed shard has settled, a single event is dispatched
+    for the pattern as a whole: CREATED if no shards existed before,
+    DELETED if none exist now, UNCHANGED if no shard's content changed,
+    or MODIFIED otherwise. The callbacks are passed the coverage data
+    merged from every shard.
+    """
+
+    def __init__(self, filename, coverage_factory=None):
+        super(ShardedCoverageWatcher, self).__init__(
+            filename, coverage_factory)
+        self.shards = {}
+        self.events = []
+        self.existed = False
+
+    def add_shard(self, filename, created=False):
+        """
+        Starts watching a shard. If created is set, the shard is treated
+        as not existing until now, so it's reported once it settles.
+        """
+        shard = ShardWatcher(filename)
+        shard.settle_time = self.settle_time
+        shard.full_hash = self.full_hash
+
+        for event in shard.callbacks:
+            shard.add_callback(
+                event, id(self), lambda event=event: self.events.append(event))
+
+        if created:
+            shard.last_state = None
+            shard.last_digest = None
+        else:
+            shard.reset()
+
+        self.shards[filename] = shard
+
+    def reset(self):
+        """
+        Records the current state of every shard, which later polls are
+        compared against.
+        """
+        self.shards = {}
+        self.events = []
+
+        for filename in glob.glob(self.filename):
+            self.add_shard(filename)
+
+        self.existed = any(shard.last_state for shard in self.shards.values())
+        debug_message("[ShardedCoverageWatcher] %d shards for %s",
+                      len(self.shards), self.filename)
+
+    def poll(self):
+        """
+        Polls every shard, including any new ones, and dispatches an
+        event for the pattern if any of them have changed. Returns True
+        if any shard has changed at all since the last event, or False
+        if none have.
+        """
+        for filename in glob.glob(self.filename):
+            if filename not in self.shards:
+                self.add_shard(filename, created=True)
+
+        active = False
+        settling = False
+
+        for filename, shard in list(self.shards.items()):
+            if shard.poll():
+                active = True
+
+            if shard.settling is not None:
+                settling = True
+            elif shard.last_state is None:
+                del self.shards[filename]
+
+        # wait until every changed shard has settled
+        self.settling = True if settling else None
+        if settling or not self.events:
+            return active
+
+        events, self.events = self.events, []
+        exists = any(shard.last_state for shard in self.shards.values())
+
+        if exists and not self.existed:
+            event = self.CREATED
+        elif self.existed and not exists:
+            event = self.DELETED
+        elif all(e == self.UNCHANGED for e in events):
+            event = self.UNCHANGED
+        else:
+            event = self.MODIFIED
+
+        self.existed = exists
+        self.dispatch(event)
+        return True
+
+
+def complete(filename):
+    """
+    Determines whether a coverage file is completely written, by
+    checking whether it ends with the closing </coverage> tag.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 64))
+            return f.read().rstrip().endswith(b'</coverage>')
+    except (IOError, OSError):
+        return False
@@ -0,0 +1,156 @@
+import multiprocessing
+import os
+import threading
+
+from php_coverage.debug import debug_message
+
+try:
+    import concurrent.futures
+    import concurrent.futures.process
+except ImportError:
+    # not available in Sublime Text 2's Python
+    concurrent = None
+
+# Seconds to wait for a worker process, before working in this process
+TIMEOUT = 30
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def available():
+    """
+    Determines whether work can be done in a worker process.
+    """
+    return concurrent is not None and get_context() is not None
+
+
+def get_context():
+    """
+    Gets the multiprocessing context used to start worker processes,
+    or None if they can't be started.
+
+    Worker processes are only ever forked from the plugin host. Other
+    start methods run sys.executable, which in Sublime is the editor
+    or plugin host rather than a Python interpreter, so the worker
+    would never start.
+    """
+    if os.name != 'posix':
+        return None
+
+    # Python 3.3 always forks on POSIX
+    if not hasattr(multiprocessing, 'get_context'):
+        return multiprocessing
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+
+    return multiprocessing.get_context('fork')
+
+
+def get_executor():
+    """
+    Gets the shared process pool, creating it if necessary. Returns
+    None if worker processes aren't available.
+    """
+    global executor
+
+    if not available():
+        return None
+
+    with executor_lock:
+        if executor is None:
+            executor = create_executor()
+
+        return executor
+
+
+def create_executor():
+    """
+    Creates a process pool with a single worker process, which is
+    forked from this process.
+    """
+    try:
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=1, mp_context=get_context())
+    except TypeError:
+        # before Python 3.7, the pool uses the default start method,
+        # which forks unless it has been changed
+        method = getattr(multiprocessing, 'get_start_method', None)
+        if method and method(allow_none=True) not in (None, 'fork'):
+            return None
+
+        return concurrent.futures.ProcessPoolExecutor(max_workers=1)
+
+
+def run(function, *args):
+    """
+    Calls a function in the worker process, blocking the calling
+    thread until it returns. The function and its arguments must be
+    picklable, so the function must be defined at the top level of a
+    module.
+
+    Raises WorkerUnavailable if the function couldn't be called in a
+    worker process, or didn't return within TIMEOUT seconds (in which
+    case the worker is terminated). Exceptions raised by the function
+    itself are re-raised in the calling thread.
+    """
+    pool = get_executor()
+    if pool is None:
+        raise WorkerUnavailable("Worker processes aren't available")
+
+    try:
+        future = pool.submit(function, *args)
+    except RuntimeError as e:
+        # the pool has been shut down
+        shutdown()
+        raise WorkerUnavailable(str(e))
+
+    try:
+        return future.result(TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        debug_message("Worker process timed out after %d seconds", TIMEOUT)
+        shutdown()
+        raise WorkerUnavailable("Worker process timed out")
+    except concurrent.futures.process.BrokenProcessPool as e:
+        debug_message("Worker process died: %s", e)
+        shutdown()
+        raise WorkerUnavailable(str(e))
+
+
+def shutdown():
+    """
+    Shuts down the shared process pool, if it's running. A new one
+    will be created next time it's needed.
+    """
+    global executor
+
+    with executor_lock:
+        pool, executor = executor, None
+
+    if pool is not None:
+        stop(pool)
+
+
+def stop(pool):
+    """
+    Stops a process pool, terminating its worker process in case it's
+    still busy, then waiting for the pool's thread to exit so nothing
+    is left running.
+    """
+    # the pool has no public way to stop a call which is running
+    processes = getattr(pool, '_processes', None) or {}
+    for process in list(processes.values()):
+        process.terminate()
+
+    pool.shutdown(wait=True)
+
+
+class WorkerUnavailable(Exception):
+
+    """
+    An exception representing a failure to run a function in a worker
+    process.
+    """
+
+    pass
@@ -0,0 +1,108 @@
+import sys
+import types
+
+
+class Region(object):
+
+    """
+    A minimal stand-in for sublime.Region.
+    """
+
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+
+class View(object):
+
+    """
+    A minimal stand-in for sublime.View, showing a file with a given
+    number of lines, each of the same length. Counts the calls made to
+    it, so tests can check them and benchmarks can report them.
+    """
+
+    def __init__(self, num_lines, line_length=40, id=1):
+        self.num_lines = num_lines
+        self.width = line_length + 1
+        self.view_id = id
+        self.top = 0
+        self.calls = 0
+        self.regions = {}
+        self.status = {}
+
+    def id(self):
+        return self.view_id
+
+    def file_name(self):
+        return '/src/file.php'
+
+    def change_count(self):
+        return 0
+
+    def text_point(self, row, col):
+        self.calls += 1
+        return row * self.width + col
+
+    def rowcol(self, point):
+        self.calls += 1
+        return point // self.width, point % self.width
+
+    def line(self, point):
+        self.calls += 1
+        start = (point // self.width) * self.width
+        return Region(start, start + self.width - 1)
+
+    def full_line(self, point):
+        self.calls += 1
+        start = (point // self.width) * self.width
+        return Region(start, start + self.width)
+
+    def lines(self, region):
+        self.calls += 1
+        first = region.begin() // self.width
+        last = region.end() // self.width
+        return [
+            Region(row * self.width, row * self.width + self.width - 1)
+            for row in range(first, last + 1)
+        ]
+
+    def visible_region(self):
+        return Region(self.top * self.width, (self.top + 60) * self.width)
+
+    def add_regions(self, name, regions, *args):
+        self.calls += 1
+        self.regions[name] = regions
+
+    def erase_regions(self, name):
+        self.calls += 1
+        self.regions.pop(name, None)
+
+    def set_status(self, key, value):
+        self.status[key] = value
+
+    def erase_status(self, key):
+        self.status.pop(key, None)
+
+
+def install():
+    """
+    Installs a fake "sublime" module, unless the real one is available,
+    so modules which import it can be tested and benchmarked outside
+    Sublime.
+    """
+    if 'sublime' in sys.modules:
+        return
+
+    module = types.ModuleType('sublime')
+    module.Region = Region
+    module.HIDDEN = 128
+    module.version = lambda: '3000'
+    module.set_timeout = lambda callback, delay: callback()
+    module.set_timeout_async = module.set_timeout
+    sys.modules['sublime'] = module
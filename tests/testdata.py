@@ -1,9 +1,25 @@
 import os
+import shutil
+import tempfile
 import unittest
 import xml.etree.ElementTree
 
+from php_coverage.config import config
 from php_coverage.data import CoverageData
+from php_coverage.data import CoverageDataCache
+from php_coverage.data import CoverageDataFactory
 from php_coverage.data import FileCoverage
+from php_coverage.data import IndexedCoverageData
+from php_coverage.data import LoadCancelled
+from php_coverage.data import MergedCoverageData
+from php_coverage.data import ScanningCoverageData
+from php_coverage.data import SliceFileCoverage
+from php_coverage.data import SnapshotFileCoverage
+from php_coverage.data import StreamingCoverageData
+from php_coverage.data import fingerprint
+from php_coverage.data import merge
+from php_coverage.data import summarise
+from php_coverage import worker
 
 
 class CoverageDataTest(unittest.TestCase):
@@ -29,6 +45,28 @@ class CoverageDataTest(unittest.TestCase):
         self.assertEquals(self.data.elements, [])
         self.assertEquals(self.data.files, {})
 
+    def test_load_cancelled(self):
+        self.data.cancel()
+        self.assertTrue(self.data.is_cancelled())
+        self.assertRaises(LoadCancelled, self.data.load)
+        self.assertFalse(self.data.is_loaded())
+
+    def test_release(self):
+        coverage = self.data.get_file('/path/to/file.php')
+        self.data.release()
+        self.assertFalse(self.data.is_loaded())
+        self.assertIs(self.data.index, None)
+        self.assertEquals(list(self.data.entries()), [])
+        self.assertIs(self.data.files[self.data.normalise(
+            '/path/to/file.php')], coverage)
+
+    def test_ensure_loaded(self):
+        self.data.ensure_loaded()
+        self.assertTrue(self.data.is_loaded())
+        elements = self.data.elements
+        self.data.ensure_loaded()
+        self.assertIs(self.data.elements, elements)
+
     def test_normalise(self):
         out = self.data.normalise('/path/to/../the/../../file')
         self.assertEquals(out, '/file')
@@ -47,6 +85,501 @@ class CoverageDataTest(unittest.TestCase):
         coverage = self.data.get_file('/path/to/nonexistent/file.php')
         self.assertIs(coverage, None)
 
+    def test_get_file_symlink(self):
+        self.data.load()
+        self.data.normalised['/link/to/file.php'] = '/path/to/file.php'
+        coverage = self.data.get_file('/link/to/file.php')
+        self.assertIsInstance(coverage, FileCoverage)
+
+    def test_build_index(self):
+        self.data.load()
+        self.assertEquals(list(self.data.index), ['/path/to/file.php'])
+        self.assertIs(self.data.resolved, None)
+
+    def test_normalise_memoised(self):
+        self.data.normalised['/some/file'] = '/memoised'
+        self.assertEquals(self.data.normalise('/some/file'), '/memoised')
+
+    def test_reuse(self):
+        previous = self.data
+        coverage = previous.get_file('/path/to/file.php')
+        self.setUp()
+        self.assertTrue(self.data.reuse(previous, '/path/to/file.php'))
+        self.assertIs(self.data.get_file('/path/to/file.php'), coverage)
+
+    def test_reuse_changed(self):
+        previous = self.data
+        coverage = FileCoverage('/path/to/file.php', None)
+        coverage.populate(16, 1, 4, [12], [13, 14, 15])
+        previous.files['/path/to/file.php'] = coverage
+        self.setUp()
+        self.assertFalse(self.data.reuse(previous, '/path/to/file.php'))
+
+    def test_reuse_not_requested(self):
+        previous = self.data
+        self.setUp()
+        self.assertFalse(self.data.reuse(previous, '/path/to/file.php'))
+
+
+class StreamingCoverageDataTest(CoverageDataTest):
+
+    def setUp(self):
+        file = os.path.join(os.path.dirname(__file__), 'data', 'test.xml')
+        self.data = StreamingCoverageData(file)
+
+    def test_load_discards_elements(self):
+        self.data.load()
+        self.assertEquals(len(self.data.elements), 1)
+        summary = self.data.elements[0]
+        self.assertIsInstance(summary, FileCoverage)
+        self.assertIs(summary.data, None)
+        self.assertEquals(summary.bad_lines, [12, 13, 14, 15])
+
+
+    def test_load_skips_malformed(self):
+        dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir)
+        file = os.path.join(dir, 'clover.xml')
+        with open(file, 'w') as f:
+            f.write('<coverage><project><file name="/a.php"/>'
+                    '<file name="/b.php"><line num="1" type="stmt" '
+                    'count="1"/><metrics loc="2" statements="1" '
+                    'coveredstatements="1"/></file></project></coverage>')
+
+        self.data = self.data.__class__(file)
+        self.assertIs(self.data.get_file('/a.php'), None)
+        self.assertEquals(self.data.get_file('/b.php').good_lines, [1])
+
+
+class ScanningCoverageDataTest(StreamingCoverageDataTest):
+
+    def setUp(self):
+        file = os.path.join(os.path.dirname(__file__), 'data', 'test.xml')
+        self.data = ScanningCoverageData(file)
+
+    def test_load_scans(self):
+        self.data.load()
+        self.assertTrue(self.data.summarised)
+        coverage = self.data.get_file('/path/to/file.php')
+        self.assertTrue(coverage.is_parsed())
+        self.assertEquals(coverage.num_lines, 16)
+        self.assertEquals(coverage.bad_lines, [12, 13, 14, 15])
+
+
+class IndexedCoverageDataTest(CoverageDataTest):
+
+    def setUp(self):
+        file = os.path.join(os.path.dirname(__file__), 'data', 'test.xml')
+        self.data = IndexedCoverageData(file)
+
+    def test_load_records_offsets(self):
+        self.data.load()
+        self.assertEquals(len(self.data.elements), 1)
+        summary = self.data.elements[0]
+        self.assertIsInstance(summary, SliceFileCoverage)
+        self.assertFalse(summary.is_parsed())
+        self.assertEquals(summary.filename, '/path/to/file.php')
+
+        with open(self.data.coverage_file, 'rb') as f:
+            content = f.read()
+        file, start, end = summary.data
+        self.assertTrue(content[start:end].startswith(b'<file name='))
+        self.assertTrue(content[start:end].endswith(b'</file>'))
+
+    def test_get_file_parses_slice(self):
+        coverage = self.data.get_file('/path/to/file.php')
+        self.assertEquals(coverage.num_lines, 16)
+        self.assertEquals(coverage.statements, 4)
+        self.assertEquals(coverage.bad_lines, [12, 13, 14, 15])
+
+    def test_get_file_rewritten(self):
+        for comment in ('', '<!-- parsed as XML -->'):
+            dir = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, dir)
+            file = os.path.join(dir, 'clover.xml')
+
+            def write(names):
+                with open(file, 'w') as f:
+                    f.write('<coverage><project>')
+                    for name, count in names:
+                        f.write(
+                            '<file name="%s">%s<line num="1" type="stmt" '
+                            'count="%d"/><metrics loc="2" statements="1" '
+                            'coveredstatements="%d"/></file>'
+                            % (name, comment, count, count))
+                    f.write('</project></coverage>')
+
+            write([('/a.php', 0), ('/b.php', 1)])
+            data = IndexedCoverageData(file)
+            coverage = data.get_file('/a.php')
+
+            write([('/b.php', 1), ('/a.php', 0)])
+            self.assertRaises(ValueError, lambda: coverage.good_lines)
+
+
+    def write(self, content):
+        dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir)
+        file = os.path.join(dir, 'clover.xml')
+        with open(file, 'w') as f:
+            f.write(content)
+        return file
+
+    def test_load_quoted_tag_end(self):
+        file = self.write(
+            '<coverage><project><file name="/a>b.php"><line num="1" '
+            'type="stmt" count="1"/><metrics loc="2" statements="1" '
+            'coveredstatements="1"/></file></project></coverage>')
+        self.data = IndexedCoverageData(file)
+        self.assertEquals(self.data.get_file('/a>b.php').good_lines, [1])
+
+    def test_load_only_project(self):
+        file = self.write(
+            '<coverage><file name="/outside.php"/><project>'
+            '<file name="/inside.php"/></project></coverage>')
+        self.data = IndexedCoverageData(file)
+        self.data.load()
+        names = [name for name, data in self.data.entries()]
+        self.assertEquals(names, ['/inside.php'])
+
+    def test_load_unparseable_tag(self):
+        class Unparseable(IndexedCoverageData):
+            def tag_name(self, tag):
+                raise xml.etree.ElementTree.ParseError("unparseable")
+
+        self.data = Unparseable(self.data.coverage_file)
+        self.data.load()
+        self.assertFalse(self.data.summarised)
+        coverage = self.data.get_file('/path/to/file.php')
+        self.assertEquals(coverage.bad_lines, [12, 13, 14, 15])
+
+
+class CoverageDataFactoryTest(unittest.TestCase):
+
+    def test_factory(self):
+        data = CoverageDataFactory().factory('/path/to/coverage.xml')
+        self.assertIsInstance(data, CoverageData)
+        self.assertEquals(data.coverage_file, '/path/to/coverage.xml')
+
+    def test_factory_class_name(self):
+        factory = CoverageDataFactory(StreamingCoverageData)
+        data = factory.factory('/path/to/coverage.xml')
+        self.assertIsInstance(data, StreamingCoverageData)
+
+
+class SnapshotCoverageDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        config.loaded = True
+        config.debug = False
+        config.snapshot = True
+        config.snapshot_dir = self.dir
+
+        file = os.path.join(os.path.dirname(__file__), 'data', 'test.xml')
+        self.data = CoverageData(file)
+
+    def tearDown(self):
+        config.loaded = False
+        del config.debug
+        del config.snapshot
+        del config.snapshot_dir
+        shutil.rmtree(self.dir)
+
+    def test_load_writes_snapshot(self):
+        self.data.load()
+        self.assertEquals(len(os.listdir(self.dir)), 1)
+        self.assertFalse(self.data.summarised)
+
+    def test_load_index_no_snapshot(self):
+        self.data = IndexedCoverageData(self.data.coverage_file)
+        self.data.load()
+        self.assertEquals(os.listdir(self.dir), [])
+        self.assertFalse(self.data.elements[0].is_parsed())
+
+    def test_load_malformed_no_snapshot(self):
+        file = os.path.join(self.dir, 'clover.xml')
+        with open(file, 'w') as f:
+            f.write('<coverage><project><file name="/a.php"/>'
+                    '</project></coverage>')
+
+        self.data = CoverageData(file)
+        self.data.load()
+        self.assertEquals(os.listdir(self.dir), ['clover.xml'])
+
+    def test_load_reads_snapshot(self):
+        self.data.load()
+        self.data.load()
+        self.assertTrue(self.data.summarised)
+
+        coverage = self.data.get_file('/path/to/file.php')
+        self.assertIsInstance(coverage, SnapshotFileCoverage)
+        self.assertEquals(coverage.num_lines, 16)
+        self.assertEquals(coverage.statements, 4)
+        self.assertEquals(coverage.good_lines, [])
+        self.assertEquals(coverage.bad_lines, [12, 13, 14, 15])
+
+
+@unittest.skipUnless(worker.available(), "requires concurrent.futures")
+class ProcessCoverageDataTest(unittest.TestCase):
+
+    def setUp(self):
+        config.loaded = True
+        config.debug = False
+        config.process_threshold = 0
+
+        file = os.path.join(os.path.dirname(__file__), 'data', 'test.xml')
+        self.data = CoverageData(file)
+
+    def tearDown(self):
+        config.loaded = False
+        del config.debug
+        del config.process_threshold
+        worker.shutdown()
+
+    def test_summarise(self):
+        records = summarise(self.data.coverage_file)
+        self.assertEquals(len(records), 1)
+        self.assertEquals(records[0][:4], ('/path/to/file.php', 16, 0, 4))
+
+    def test_load_in_process(self):
+        self.data.load()
+        self.assertTrue(self.data.summarised)
+        coverage = self.data.get_file('/path/to/file.php')
+        self.assertTrue(coverage.is_parsed())
+        self.assertEquals(coverage.num_lines, 16)
+        self.assertEquals(coverage.statements, 4)
+        self.assertEquals(coverage.bad_lines, [12, 13, 14, 15])
+
+    def test_load_below_threshold(self):
+        config.process_threshold = 1
+        self.data.load()
+        self.assertFalse(self.data.summarised)
+
+    def test_load_index(self):
+        self.data = IndexedCoverageData(self.data.coverage_file)
+        state = fingerprint(self.data.coverage_file)
+        self.assertFalse(self.data.use_process(state))
+
+
+class CoverageDataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.file = os.path.join(os.path.dirname(__file__), 'data', 'test.xml')
+        self.cache = CoverageDataCache(budget=1024 * 1024)
+
+    def test_get_shared(self):
+        data = self.cache.get(self.file, CoverageData)
+        self.assertIs(self.cache.get(self.file, CoverageData), data)
+
+    def test_get_by_class(self):
+        data = self.cache.get(self.file, CoverageData)
+        other = self.cache.get(self.file, StreamingCoverageData)
+        self.assertIsNot(other, data)
+        self.assertIsInstance(other, StreamingCoverageData)
+
+    def test_get_nonexistent_file(self):
+        file = '/path/to/nonexistent/coverage.xml'
+        data = self.cache.get(file, CoverageData)
+        self.assertIsNot(self.cache.get(file, CoverageData), data)
+        self.assertEquals(len(self.cache.entries), 0)
+
+    def test_evict(self):
+        self.cache.budget = 0
+        data = self.cache.get(self.file, CoverageData)
+        self.cache.get(self.file, StreamingCoverageData)
+        self.assertEquals(len(self.cache.entries), 1)
+        self.assertIsNot(self.cache.get(self.file, CoverageData), data)
+
+    def test_get_previous(self):
+        dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir)
+        file = os.path.join(dir, 'clover.xml')
+        shutil.copy(self.file, file)
+
+        data = self.cache.get(file, CoverageData)
+        coverage = data.get_file('/path/to/file.php')
+        with open(file, 'a') as f:
+            f.write('\n')
+
+        other = self.cache.get(file, CoverageData)
+        self.assertIsNot(other, data)
+        self.assertTrue(data.is_cancelled())
+        self.assertFalse(other.is_cancelled())
+        self.assertEquals(len(self.cache.entries), 1)
+
+        # the previous version is released, except for requested files
+        self.assertFalse(data.is_loaded())
+        self.assertIs(data.index, None)
+        self.assertEquals(list(data.files.values()), [coverage])
+        self.assertTrue(other.reuse(data, '/path/to/file.php'))
+
+    def test_get_deleted(self):
+        dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir)
+        file = os.path.join(dir, 'clover.xml')
+        shutil.copy(self.file, file)
+
+        data = self.cache.get(file, CoverageData)
+        os.remove(file)
+
+        self.cache.get(file, CoverageData)
+        self.assertTrue(data.is_cancelled())
+        self.assertEquals(len(self.cache.entries), 0)
+
+    def test_factory(self):
+        factory = CoverageDataFactory(CoverageData, self.cache)
+        data = factory.factory(self.file)
+        factory = CoverageDataFactory(cache=self.cache)
+        self.assertIs(factory.factory(self.file), data)
+
+
+class MergedCoverageDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.pattern = os.path.join(self.dir, 'clover-*.xml')
+        self.cache = CoverageDataCache(budget=1024 * 1024)
+        self.factory = CoverageDataFactory(CoverageData, self.cache)
+
+        file = os.path.join(os.path.dirname(__file__), 'data', 'test.xml')
+        with open(file) as f:
+            self.template = f.read()
+
+        self.first = self.shard('1', [12, 13])
+        self.second = self.shard('2', [14])
+
+    def shard(self, name, covered, mtime=None):
+        content = self.template
+        for line in covered:
+            content = content.replace(
+                '<line num="%d" type="stmt" count="0"/>' % line,
+                '<line num="%d" type="stmt" count="2"/>' % line,
+            )
+
+        filename = os.path.join(self.dir, 'clover-%s.xml' % name)
+        with open(filename, 'w') as f:
+            f.write(content)
+
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+
+        return filename
+
+    def test_factory(self):
+        data = self.factory.factory(self.pattern)
+        self.assertIsInstance(data, MergedCoverageData)
+        self.assertIs(self.factory.factory(self.pattern), data)
+        self.assertIs(data.get_coverage_factory().cache, self.cache)
+
+    def test_load(self):
+        data = self.factory.factory(self.pattern)
+        data.load()
+        self.assertEquals(
+            [shard.coverage_file for shard in data.elements],
+            [self.first, self.second],
+        )
+        self.assertTrue(all(shard.is_loaded() for shard in data.elements))
+
+    def test_get_file(self):
+        data = self.factory.factory(self.pattern)
+        coverage = data.get_file('/path/to/file.php')
+        self.assertEquals(coverage.good_lines, [12, 13, 14])
+        self.assertEquals(coverage.bad_lines, [15])
+        self.assertEquals(coverage.covered, 3)
+        self.assertEquals(coverage.statements, 4)
+        self.assertEquals(coverage.num_lines, 16)
+        self.assertIs(data.get_file('/path/to/file.php'), coverage)
+
+    def test_get_file_missing(self):
+        data = self.factory.factory(self.pattern)
+        self.assertIs(data.get_file('/path/to/other.php'), None)
+
+    def test_entries(self):
+        data = self.factory.factory(self.pattern)
+        data.load()
+        entries = list(data.entries())
+        self.assertEquals(len(entries), 1)
+        name, coverage = entries[0]
+        self.assertEquals(name, '/path/to/file.php')
+        self.assertEquals(coverage.good_lines, [12, 13, 14])
+
+    def test_no_shards(self):
+        data = self.factory.factory(os.path.join(self.dir, 'none-*.xml'))
+        self.assertIs(data.get_file('/path/to/file.php'), None)
+        self.assertEquals(len(self.cache.entries), 0)
+
+    def test_changed_shard(self):
+        data = self.factory.factory(self.pattern)
+        data.get_file('/path/to/file.php')
+        first, second = data.elements
+
+        self.shard('2', [15], 1000000000)
+        other = self.factory.factory(self.pattern)
+        self.assertIsNot(other, data)
+        self.assertTrue(data.is_cancelled())
+
+        # only the changed shard is loaded again
+        coverage = other.get_file('/path/to/file.php')
+        self.assertIs(other.elements[0], first)
+        self.assertIsNot(other.elements[1], second)
+        self.assertTrue(second.is_cancelled())
+        self.assertEquals(coverage.good_lines, [12, 13, 15])
+        self.assertEquals(coverage.bad_lines, [14])
+        self.assertFalse(other.reuse(data, '/path/to/file.php'))
+
+    def test_new_shard(self):
+        data = self.factory.factory(self.pattern)
+        data.get_file('/path/to/file.php')
+
+        self.shard('3', [15])
+        other = self.factory.factory(self.pattern)
+        self.assertTrue(data.is_cancelled())
+        coverage = other.get_file('/path/to/file.php')
+        self.assertEquals(coverage.good_lines, [12, 13, 14, 15])
+        self.assertEquals(coverage.bad_lines, [])
+
+    def test_load_cancelled_shard(self):
+        data = self.factory.factory(self.pattern)
+        self.factory.factory(self.second).cancel()
+        self.assertRaises(LoadCancelled, data.load)
+        self.assertFalse(data.is_loaded())
+
+
+class MergeTest(unittest.TestCase):
+
+    def coverage(self, num_lines, covered, statements, good, bad):
+        coverage = FileCoverage('/path/to/file.php', None)
+        coverage.populate(num_lines, covered, statements, good, bad)
+        return coverage
+
+    def test_single(self):
+        coverage = self.coverage(16, 1, 2, [3], [4])
+        self.assertIs(merge('/path/to/file.php', [coverage]), coverage)
+
+    def test_merge(self):
+        coverage = merge('/path/to/file.php', [
+            self.coverage(16, 1, 3, [3], [4, 5]),
+            self.coverage(16, 2, 3, [5, 4], [3]),
+        ])
+        self.assertEquals(coverage.filename, '/path/to/file.php')
+        self.assertEquals(coverage.num_lines, 16)
+        self.assertEquals(coverage.covered, 3)
+        self.assertEquals(coverage.statements, 3)
+        self.assertEquals(coverage.good_lines, [3, 4, 5])
+        self.assertEquals(coverage.bad_lines, [])
+
+    def test_merge_metrics(self):
+        coverage = merge('/path/to/file.php', [
+            self.coverage(20, 5, 6, [3], [4]),
+            self.coverage(16, 1, 4, [3], [4]),
+        ])
+        self.assertEquals(coverage.num_lines, 20)
+        self.assertEquals(coverage.covered, 5)
+        self.assertEquals(coverage.statements, 6)
+        self.assertEquals(coverage.bad_lines, [4])
+
 
 class FileCoverageTest(unittest.TestCase):
 
@@ -72,5 +605,19 @@ class FileCoverageTest(unittest.TestCase):
     def test_get_implicit_parse(self):
         self.assertEquals(self.coverage.num_lines, 16)
 
+    def test_parse_compact(self):
+        self.coverage.parse()
+        self.assertIs(self.coverage.data, None)
+        self.assertEquals(self.coverage._bad_lines.itemsize, 4)
+        self.assertFalse(hasattr(self.coverage, '__dict__'))
+
+    def test_populate(self):
+        coverage = FileCoverage('/path/to/file.php', None)
+        coverage.populate(16, 1, 2, [3], (4,))
+        self.assertTrue(coverage.is_parsed())
+        self.assertEquals(coverage.covered, 1)
+        self.assertEquals(coverage.good_lines, [3])
+        self.assertEquals(coverage.bad_lines, [4])
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,20 @@
 import os
+import shutil
+import sys
+import tempfile
+import time
 import unittest
 
 from php_coverage.config import config
-from php_coverage.finder import CoverageFinder
+from php_coverage.finder import CoverageFinder, FinderCache
+from php_coverage.finder import escape, is_pattern, POSITIVE_TTL
+
+if sys.version_info >= (3, 3):
+    from unittest.mock import patch
+else:
+    path = os.path.abspath(os.path.dirname(__file__))
+    sys.path.append(os.path.join(path, '..', 'dist'))
+    from mock import patch
 
 
 class CoverageFinderTest(unittest.TestCase):
@@ -11,7 +23,8 @@ class CoverageFinderTest(unittest.TestCase):
         config.loaded = True
         config.debug = True
         config.report_path = 'foo/bar/baz.xml'
-        self.finder = CoverageFinder()
+        self.cache = FinderCache()
+        self.finder = CoverageFinder(self.cache)
         dir = os.path.join(os.path.dirname(__file__), 'finder')
         self.invalid_src = dir
         self.src = os.path.join(dir, 'src', 'path', 'test.php')
@@ -27,3 +40,79 @@ class CoverageFinderTest(unittest.TestCase):
 
     def test_find_invalid(self):
         self.assertIs(self.finder.find(self.invalid_src), None)
+
+    def test_find_cached(self):
+        self.finder.find(self.src)
+        dir = os.path.dirname(self.src)
+        self.assertEquals(self.cache.get('foo/bar/baz.xml', dir),
+                          (True, self.coverage))
+
+        # sibling directories share the cached ancestors
+        cached = os.path.abspath(__file__)
+        self.cache.set('foo/bar/baz.xml', [os.path.dirname(dir)], cached)
+        self.assertEquals(self.finder.find(self.src), self.coverage)
+        sibling = os.path.join(os.path.dirname(dir), 'other', 'test.php')
+        self.assertEquals(self.finder.find(sibling), cached)
+
+    def test_find_invalid_cached(self):
+        self.finder.find(self.invalid_src)
+        dir = os.path.dirname(self.invalid_src)
+        self.assertEquals(self.cache.get('foo/bar/baz.xml', dir),
+                          (True, None))
+
+    def test_find_cached_deleted(self):
+        dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir)
+        src = os.path.join(dir, 'src', 'test.php')
+        coverage = os.path.join(dir, 'foo', 'bar', 'baz.xml')
+        os.makedirs(os.path.dirname(coverage))
+        open(coverage, 'w').close()
+        self.assertEquals(self.finder.find(src), coverage)
+
+        os.remove(coverage)
+        self.assertIs(self.finder.find(src), None)
+
+    def test_find_cached_expires(self):
+        dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir)
+        src = os.path.join(dir, 'src', 'test.php')
+        outer = os.path.join(dir, 'foo', 'bar', 'baz.xml')
+        os.makedirs(os.path.dirname(outer))
+        open(outer, 'w').close()
+        self.assertEquals(self.finder.find(src), outer)
+
+        # a coverage file created closer to the source file
+        nested = os.path.join(dir, 'src', 'foo', 'bar', 'baz.xml')
+        os.makedirs(os.path.dirname(nested))
+        open(nested, 'w').close()
+        self.assertEquals(self.finder.find(src), outer)
+
+        later = time.time() + POSITIVE_TTL + 1
+        with patch('time.time', return_value=later):
+            self.assertEquals(self.finder.find(src), nested)
+
+    def test_invalidate(self):
+        self.finder.find(self.src)
+        self.finder.find(self.invalid_src)
+        self.cache.invalidate(self.coverage)
+        self.assertEquals(self.cache.entries, {})
+
+    def test_find_pattern(self):
+        config.report_path = 'foo/*/baz*.xml'
+        pattern = os.path.join(self.invalid_src, 'foo', '*', 'baz*.xml')
+        self.assertEquals(self.finder.find(self.src), pattern)
+
+    def test_find_pattern_invalid(self):
+        config.report_path = 'foo/*/nothing-*.xml'
+        self.assertIs(self.finder.find(self.src), None)
+
+    def test_is_pattern(self):
+        self.assertTrue(is_pattern('build/logs/clover-*.xml'))
+        self.assertTrue(is_pattern('build/logs/clover-?.xml'))
+        self.assertTrue(is_pattern('build/logs/clover-[0-9].xml'))
+        self.assertFalse(is_pattern('build/logs/clover.xml'))
+
+    def test_escape(self):
+        self.assertEquals(escape('/path/[a]/*?'), '/path/[[]a]/[*][?]')
+        self.assertEquals(escape('/path/to'), '/path/to')
+
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from php_coverage import inotify
+
+
+@unittest.skipUnless(inotify.available(), "inotify not available")
+class InotifyBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file = os.path.join(self.dir, 'test.txt')
+        self.backend = inotify.InotifyBackend()
+        self.backend.add(self.file)
+        self.result = None
+        self.woken = threading.Event()
+        self.thread = threading.Thread(target=self.wait)
+        self.thread.start()
+
+    def tearDown(self):
+        self.backend.wake()
+        self.thread.join(1)
+        self.backend.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def wait(self):
+        self.result = self.backend.wait()
+        self.woken.set()
+
+    def test_wait_file_written(self):
+        with open(self.file, 'w') as f:
+            f.write('written')
+        self.assertTrue(self.woken.wait(1))
+        self.assertEquals(self.result, (set([self.file]), set()))
+
+    def test_wait_ignores_other_files(self):
+        with open(os.path.join(self.dir, 'other.txt'), 'w') as f:
+            f.write('other')
+        self.assertFalse(self.woken.wait(0.3))
+
+    def test_wait_timeout_other_files_changing(self):
+        # events for other files in the directory don't restart the wait
+        stop = threading.Event()
+
+        def write():
+            while not stop.is_set():
+                with open(os.path.join(self.dir, 'other.txt'), 'w') as f:
+                    f.write('other')
+                time.sleep(0.05)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            start = time.time()
+            self.assertEquals(self.backend.wait(0.3), (set(), set()))
+            self.assertLess(time.time() - start, 1)
+        finally:
+            stop.set()
+            writer.join()
+
+    def test_wait_removed_file(self):
+        self.backend.remove(self.file)
+        self.assertEquals(self.backend.directories, {})
+        with open(self.file, 'w') as f:
+            f.write('removed')
+        self.assertFalse(self.woken.wait(0.3))
+
+    def test_wake(self):
+        self.backend.wake()
+        self.assertTrue(self.woken.wait(1))
+        self.assertEquals(self.result, (set(), set()))
+
+    def test_directory_deleted(self):
+        shutil.rmtree(self.dir)
+        self.assertTrue(self.woken.wait(1))
+        self.assertEquals(self.result[1], set([self.file]))
@@ -1,7 +1,8 @@
+import sys
 import unittest
 
 from php_coverage.config import config
-from php_coverage.matcher import Matcher
+from php_coverage.matcher import Matcher, MatcherCache, PatternList
 
 
 class MatcherTest(unittest.TestCase):
@@ -11,7 +12,8 @@ class MatcherTest(unittest.TestCase):
         # config.debug = True
         config.include = [r"foo.*\.php$", r"win[\\/]do[\\/]ws\.php"]
         config.exclude = [r"foo.*bar\.php$", "foofoo\.php$"]
-        self.matcher = Matcher()
+        self.cache = MatcherCache()
+        self.matcher = Matcher(self.cache)
 
     def tearDown(self):
         config.loaded = False
@@ -46,3 +48,43 @@ class MatcherTest(unittest.TestCase):
         self.assertTrue(self.matcher.match(patterns, 'mynewtester'))
         self.assertFalse(self.matcher.match(patterns, 'testtest'))
         self.assertFalse(self.matcher.match(patterns, 'newesttest'))
+
+    def test_should_include_cached(self):
+        self.assertTrue(self.matcher.should_include('foo.php'))
+        self.assertEquals(list(self.cache.decisions.items()),
+                          [('foo.php', True)])
+
+    def test_should_include_patterns_replaced(self):
+        self.assertTrue(self.matcher.should_include('foo.php'))
+        config.exclude = [r"foo\.php$"]
+        self.assertFalse(self.matcher.should_include('foo.php'))
+
+    def test_clear(self):
+        self.matcher.should_include('foo.php')
+        self.cache.clear()
+        self.assertEquals(len(self.cache.decisions), 0)
+        self.assertEquals(self.cache.compiled, {})
+
+    def test_compile_combined(self):
+        compiled = self.cache.compile([r"foo", r"bar"])
+        self.assertNotIsInstance(compiled, PatternList)
+        self.assertIs(self.cache.compile([r"foo", r"bar"]), compiled)
+
+    def test_compile_groups(self):
+        patterns = [r"(a)\1", r"(b)\1"]
+        self.assertIsInstance(self.cache.compile(patterns), PatternList)
+        self.assertTrue(self.matcher.match(patterns, 'xbb'))
+        self.assertFalse(self.matcher.match(patterns, 'xab'))
+
+    def test_compile_inline_flags(self):
+        patterns = [r"(?i)\.PHP$", r"Foo"]
+        self.assertIsInstance(self.cache.compile(patterns), PatternList)
+        self.assertTrue(self.matcher.match(patterns, '/src/foo.php'))
+        self.assertFalse(self.matcher.match(patterns, '/src/foo.txt'))
+
+    @unittest.skipIf(sys.version_info < (3, 6),
+                     "scoped flags require Python 3.6")
+    def test_compile_scoped_flags(self):
+        patterns = [r"(?i:\.PHP)$", r"Foo"]
+        self.assertNotIsInstance(self.cache.compile(patterns), PatternList)
+        self.assertFalse(self.matcher.match(patterns, '/src/foo.txt'))
@@ -0,0 +1,111 @@
+import os
+import sys
+import unittest
+
+from php_coverage.data import LoadCancelled
+from php_coverage.mediator import ViewWatcherMediator
+from php_coverage.updates import UpdateQueue
+from php_coverage.watcher import CoverageWatcher
+
+if sys.version_info >= (3, 3):
+    from unittest.mock import Mock, MagicMock
+else:
+    path = os.path.abspath(os.path.dirname(__file__))
+    sys.path.append(os.path.join(path, '..', 'dist'))
+    from mock import Mock, MagicMock
+
+
+class ViewWatcherMediatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.set_timeout = MagicMock()
+        self.queue = UpdateQueue(self.set_timeout, lambda view: 0)
+        self.callback = MagicMock()
+        self.mediator = ViewWatcherMediator(
+            {}, Mock(), Mock(), update_queue=self.queue)
+        self.watcher = CoverageWatcher('/path/to/coverage.xml', Mock())
+
+        self.view = Mock()
+        self.view.id = MagicMock(return_value=1)
+
+    def test_prepare_callback_queues(self):
+        wrapped = self.mediator.prepare_callback(
+            self.callback, self.view, self.watcher)
+        wrapped('data')
+        self.assertFalse(self.callback.called)
+
+        self.queue.flush()
+        self.callback.assert_called_once_with(self.view, 'data')
+
+    def test_prepare_callback_latest_only(self):
+        wrapped = self.mediator.prepare_callback(
+            self.callback, self.view, self.watcher)
+        wrapped('old')
+        wrapped('new')
+        self.queue.flush()
+        self.callback.assert_called_once_with(self.view, 'new')
+
+    def test_prepare_callback_after_other_events(self):
+        # a later event which doesn't call back mustn't stop the update
+        wrapped = self.mediator.prepare_callback(
+            self.callback, self.view, self.watcher)
+        wrapped('data')
+        self.watcher.dispatch(CoverageWatcher.UNCHANGED)
+        self.watcher.dispatch(CoverageWatcher.MODIFIED)
+        self.queue.flush()
+        self.callback.assert_called_once_with(self.view, 'data')
+
+    def data(self, unchanged):
+        data = Mock()
+        data.reuse = MagicMock(return_value=unchanged)
+        return data
+
+    def test_prepare_callback_unchanged(self):
+        self.watcher.add_callback(
+            CoverageWatcher.MODIFIED, 1, Mock(), '/file.php')
+        wrapped = self.mediator.prepare_callback(
+            self.callback, self.view, self.watcher)
+        first = self.data(False)
+        wrapped(first)
+        self.queue.flush()
+
+        second = self.data(True)
+        wrapped(second)
+        self.queue.flush()
+
+        second.reuse.assert_called_once_with(first, '/file.php')
+        self.callback.assert_called_once_with(self.view, first)
+
+    def test_prepare_callback_compares_with_applied(self):
+        self.watcher.add_callback(
+            CoverageWatcher.MODIFIED, 1, Mock(), '/file.php')
+        wrapped = self.mediator.prepare_callback(
+            self.callback, self.view, self.watcher)
+        applied = self.data(False)
+        wrapped(applied)
+        self.queue.flush()
+
+        # an update replaced in the queue before it was applied isn't
+        # what the newest data is compared with
+        wrapped(self.data(False))
+        latest = self.data(False)
+        wrapped(latest)
+        self.queue.flush()
+
+        latest.reuse.assert_called_once_with(applied, '/file.php')
+        self.callback.assert_called_with(self.view, latest)
+
+    def test_prepare_callback_cancelled(self):
+        self.watcher.add_callback(
+            CoverageWatcher.MODIFIED, 1, Mock(), '/file.php')
+        wrapped = self.mediator.prepare_callback(
+            self.callback, self.view, self.watcher)
+        wrapped(self.data(False))
+        self.queue.flush()
+
+        data = self.data(False)
+        data.reuse.side_effect = LoadCancelled()
+        wrapped(data)
+        self.queue.flush()
+        self.assertEquals(self.callback.call_count, 1)
+
@@ -0,0 +1,95 @@
+import os
+import unittest
+import xml.etree.ElementTree
+
+from php_coverage.data import FileCoverage
+from php_coverage.scanner import ScanError, scan, scan_element
+
+
+class ScannerTest(unittest.TestCase):
+
+    def setUp(self):
+        file = os.path.join(os.path.dirname(__file__), 'data', 'test.xml')
+        with open(file, 'rb') as f:
+            self.data = f.read()
+
+    def parse(self, data):
+        "Parse coverage data using ElementTree, in the same form as scan()"
+        root = xml.etree.ElementTree.fromstring(data)
+        result = []
+
+        for element in root.findall('./project//file'):
+            coverage = FileCoverage(element.get('name'), element)
+            result.append((
+                coverage.filename,
+                coverage.num_lines,
+                coverage.covered,
+                coverage.statements,
+                coverage.good_lines,
+                coverage.bad_lines,
+            ))
+
+        return result
+
+    def scan(self, data):
+        "Scan coverage data, converting the line arrays to lists"
+        return [
+            record[:4] + (record[4].tolist(), record[5].tolist())
+            for record in scan(data)
+        ]
+
+    def test_scan(self):
+        self.assertEquals(self.scan(self.data), self.parse(self.data))
+        self.assertEquals(self.scan(self.data)[0][0], '/path/to/file.php')
+
+    def test_scan_lines(self):
+        data = self.data.replace(
+            b'<line num="13" type="stmt" count="0"/>',
+            b'<line num="13" type="stmt" count="3"/>'
+            b'<line num="0" type="stmt" count="1"/>'
+            b'<line num="99" type="stmt" count="1"/>'
+        )
+        self.assertEquals(self.scan(data), self.parse(data))
+        self.assertEquals(self.scan(data)[0][4], [13])
+
+    def test_scan_entities(self):
+        data = self.data.replace(b'/path/to/file.php', b'/a&amp;b&#233;.php')
+        self.assertEquals(self.scan(data), self.parse(data))
+
+    def test_scan_comment(self):
+        data = self.data.replace(b'<package', b'<!-- comment --><package')
+        self.assertRaises(ScanError, scan, data)
+
+    def test_scan_attribute_order(self):
+        data = self.data.replace(
+            b'<line num="12" type="stmt" count="0"/>',
+            b'<line type="stmt" num="12" count="0"/>',
+        )
+        self.assertRaises(ScanError, scan, data)
+
+    def test_scan_unexpected_element(self):
+        data = self.data.replace(
+            b'<line num="12"', b'<extra/><line num="12"')
+        self.assertRaises(ScanError, scan, data)
+
+    def test_scan_incomplete(self):
+        data = self.data[:self.data.rfind(b'</coverage>')]
+        self.assertRaises(ScanError, scan, data)
+
+    def test_scan_file_outside_project(self):
+        data = self.data.replace(
+            b'</project>', b'</project><file name="x"><metrics/></file>')
+        self.assertRaises(ScanError, scan, data)
+
+    def test_scan_element(self):
+        start = self.data.find(b'<file')
+        end = self.data.find(b'</file>') + len(b'</file>')
+        record = scan_element(self.data[start:end])
+        self.assertEquals(record[:4], ('/path/to/file.php', 16, 0, 4))
+        self.assertEquals(record[5].tolist(), [12, 13, 14, 15])
+
+    def test_scan_element_invalid(self):
+        self.assertRaises(ScanError, scan_element, b'<file name="x"/>')
+
+if __name__ == '__main__':
+    unittest.main()
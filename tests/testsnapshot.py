@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from php_coverage.data import FileCoverage
+from php_coverage.snapshot import Snapshot
+
+FINGERPRINT = (123, 1370000000000000000, 456)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.snapshot = Snapshot(os.path.join(self.dir, 'test.snapshot'))
+
+        coverage = FileCoverage('/path/to/file.php', None)
+        coverage.populate(16, 2, 4, [12, 13], [14, 15])
+        self.snapshot.write(FINGERPRINT, [coverage])
+
+    def tearDown(self):
+        self.snapshot.close()
+        shutil.rmtree(self.dir)
+
+    def test_open(self):
+        self.assertTrue(self.snapshot.open(FINGERPRINT))
+        self.assertEquals(len(self.snapshot.records), 1)
+        self.assertEquals(self.snapshot.records[0][:4],
+                          ('/path/to/file.php', 16, 2, 4))
+
+    def test_open_changed(self):
+        self.assertFalse(self.snapshot.open((124, 0, 456)))
+
+    def test_open_nonexistent(self):
+        snapshot = Snapshot(os.path.join(self.dir, 'nonexistent'))
+        self.assertFalse(snapshot.open(FINGERPRINT))
+
+    def test_open_truncated(self):
+        with open(self.snapshot.filename, 'r+b') as f:
+            f.truncate(40)
+        self.assertFalse(self.snapshot.open(FINGERPRINT))
+
+    def test_lines(self):
+        self.snapshot.open(FINGERPRINT)
+        good, bad = self.snapshot.lines(self.snapshot.records[0])
+        self.assertEquals(list(good), [12, 13])
+        self.assertEquals(list(bad), [14, 15])
@@ -0,0 +1,125 @@
+import unittest
+
+from php_coverage.config import config
+from php_coverage.stats import Stats, null_timer, stats, timed
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = Stats(size=100)
+        self.stats.enabled = True
+
+    def test_timer_records_duration(self):
+        with self.stats.timer('op'):
+            pass
+
+        self.assertEqual(1, self.stats.totals['op'])
+        self.assertEqual(1, len(self.stats.samples['op']))
+        self.assertTrue(self.stats.samples['op'][0] >= 0)
+
+    def test_disabled_timer_records_nothing(self):
+        self.stats.enabled = False
+        self.assertIs(null_timer, self.stats.timer('op'))
+
+        with self.stats.timer('op'):
+            pass
+
+        self.stats.count('event')
+        self.assertEqual({}, self.stats.samples)
+        self.assertEqual(0, self.stats.counts['event'])
+
+    def test_timer_records_exceptions(self):
+        def fail():
+            with self.stats.timer('op'):
+                raise ValueError()
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(1, self.stats.totals['op'])
+
+    def test_samples_are_bounded(self):
+        for i in range(250):
+            self.stats.record('op', i)
+
+        self.assertEqual(100, len(self.stats.samples['op']))
+        self.assertEqual(250, self.stats.totals['op'])
+        self.assertEqual(150, min(self.stats.samples['op']))
+
+    def test_percentiles(self):
+        for i in range(100, 0, -1):
+            self.stats.record('op', i)
+
+        self.assertEqual(
+            {50: 50, 90: 90, 99: 99, 100: 100},
+            self.stats.percentiles('op', (50, 90, 99, 100)),
+        )
+
+    def test_percentiles_single_sample(self):
+        self.stats.record('op', 3)
+        self.assertEqual({50: 3, 90: 3, 99: 3},
+                         self.stats.percentiles('op'))
+
+    def test_percentiles_without_samples(self):
+        self.assertIsNone(self.stats.percentiles('op'))
+
+    def test_count(self):
+        self.stats.count('event')
+        self.stats.count('event', 2)
+        self.assertEqual(3, self.stats.counts['event'])
+
+    def test_summary(self):
+        self.stats.record('op', 0.002)
+        self.stats.count('event')
+        summary = self.stats.summary()
+
+        self.assertTrue(summary[0].startswith('Operation'))
+        self.assertTrue(summary[1].startswith('op '))
+        self.assertIn('2.000', summary[1])
+        self.assertTrue(summary[-1].startswith('event '))
+
+    def test_summary_when_disabled(self):
+        self.stats.enabled = False
+        self.assertIn('"stats"', self.stats.summary()[-1])
+
+    def test_clear(self):
+        self.stats.record('op', 1)
+        self.stats.count('event')
+        self.stats.clear()
+
+        self.assertIsNone(self.stats.percentiles('op'))
+        self.assertEqual(0, self.stats.counts['event'])
+
+    def test_configure(self):
+        loaded = config.loaded
+        config.loaded = True
+
+        try:
+            config.stats = True
+            self.stats.configure()
+            self.assertTrue(self.stats.enabled)
+
+            config.stats = False
+            self.stats.configure()
+            self.assertFalse(self.stats.enabled)
+        finally:
+            config.loaded = loaded
+            del config.stats
+
+    def test_timed(self):
+        @timed('timed.op')
+        def function(value):
+            return value * 2
+
+        enabled = stats.enabled
+        stats.enabled = True
+
+        try:
+            self.assertEqual(4, function(2))
+            self.assertEqual(1, stats.totals['timed.op'])
+
+            stats.enabled = False
+            self.assertEqual(6, function(3))
+            self.assertEqual(1, stats.totals['timed.op'])
+        finally:
+            stats.enabled = enabled
+            stats.clear()
@@ -22,6 +22,36 @@ class NullPollingThreadTest(unittest.TestCase):
         with self.assertRaises(Timeout):
             self.thread.stop(0)
 
+    def test_tick(self):
+        self.assertEquals(self.thread.tick(), 0.1)
+        self.thread.adapt(False)
+        self.assertEquals(self.thread.tick(), 0.1)
+
     def test_poll_is_abstract(self):
         with self.assertRaises(NotImplementedError):
             PollingThread().poll()
+
+
+class AdaptivePollingThreadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.thread = NullPollingThread(min_tick=0.1, max_tick=0.5)
+
+    def test_backoff(self):
+        self.thread.adapt(False)
+        self.assertEquals(self.thread.tick(), 0.2)
+        self.thread.adapt(False)
+        self.assertEquals(self.thread.tick(), 0.4)
+        self.thread.adapt(False)
+        self.assertEquals(self.thread.tick(), 0.5)
+
+    def test_active(self):
+        self.thread.adapt(False)
+        self.thread.adapt(False)
+        self.thread.adapt(True)
+        self.assertEquals(self.thread.tick(), 0.1)
+
+    def test_unknown(self):
+        self.thread.adapt(False)
+        self.thread.adapt(None)
+        self.assertEquals(self.thread.tick(), 0.2)
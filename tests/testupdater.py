@@ -0,0 +1,296 @@
+import array
+import unittest
+
+from tests import fake
+
+fake.install()
+
+from php_coverage.config import config
+from php_coverage.data import FileCoverage
+from php_coverage.updater import AppliedCoverage, STATUS, ViewUpdater
+from php_coverage.updater import VIEWPORT, clip, runs, union, within
+
+GOOD = 'SublimePHPCoverageGood'
+BAD = 'SublimePHPCoverageBad'
+
+
+class RecordingView(fake.View):
+
+    """
+    A fake view which records the changes made to its regions and
+    status, and whose change count can be set.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingView, self).__init__(*args, **kwargs)
+        self.changes = []
+        self.count = 0
+
+    def change_count(self):
+        return self.count
+
+    def add_regions(self, name, regions, *args):
+        self.changes.append(('add_regions', name))
+        super(RecordingView, self).add_regions(name, regions, *args)
+
+    def erase_regions(self, name):
+        self.changes.append(('erase_regions', name))
+        super(RecordingView, self).erase_regions(name)
+
+    def set_status(self, key, value):
+        self.changes.append(('set_status', key))
+        super(RecordingView, self).set_status(key, value)
+
+    def erase_status(self, key):
+        self.changes.append(('erase_status', key))
+        super(RecordingView, self).erase_status(key)
+
+
+def coverage(good, bad, num_lines=100):
+    coverage = FileCoverage('/src/file.php', None)
+    statements = len(good) + len(bad)
+    coverage.populate(num_lines, len(good), statements, good, bad)
+    return coverage
+
+
+class ViewUpdaterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.view = RecordingView(100)
+        self.updater = ViewUpdater(AppliedCoverage())
+
+    def test_update(self):
+        self.updater.update(self.view, coverage([1, 2], [3]))
+        self.assertEquals(sorted(self.view.changes), [
+            ('add_regions', BAD),
+            ('add_regions', GOOD),
+            ('set_status', STATUS),
+        ])
+        self.assertEquals(self.view.status[STATUS],
+                          'Code coverage: 2/3 lines (66.67%)')
+
+    def test_update_unchanged(self):
+        self.updater.update(self.view, coverage([1, 2], [3]))
+        self.view.changes = []
+        self.view.calls = 0
+
+        self.updater.update(self.view, coverage([1, 2], [3]))
+        self.assertEquals(self.view.changes, [])
+        self.assertEquals(self.view.calls, 0)
+
+    def test_update_one_key(self):
+        self.updater.update(self.view, coverage([1, 2], [3]))
+        self.view.changes = []
+
+        # the same statements, but line 3 is now covered too
+        self.updater.update(self.view, coverage([1, 2, 3], []))
+        self.assertEquals(sorted(self.view.changes), [
+            ('add_regions', GOOD),
+            ('erase_regions', BAD),
+            ('set_status', STATUS),
+        ])
+
+        # only the uncovered lines change, not the totals
+        self.view.changes = []
+        shown = coverage([1, 2], [4])
+        shown.populate(100, 3, 3, [1, 2, 3], [4])
+        self.updater.update(self.view, shown)
+        self.assertEquals(self.view.changes, [('add_regions', BAD)])
+
+    def test_update_after_edit(self):
+        self.updater.update(self.view, coverage([1, 2], [3]))
+        self.view.changes = []
+        self.view.count = 1
+
+        self.updater.update(self.view, coverage([1, 2], [3]))
+        self.assertEquals(sorted(self.view.changes), [
+            ('add_regions', BAD),
+            ('add_regions', GOOD),
+            ('set_status', STATUS),
+        ])
+
+    def test_update_no_coverage(self):
+        self.updater.update(self.view, coverage([1, 2], [3]))
+        self.view.changes = []
+
+        self.updater.update(self.view, None)
+        self.assertEquals(sorted(self.view.changes), [
+            ('erase_regions', BAD),
+            ('erase_regions', GOOD),
+            ('erase_status', STATUS),
+        ])
+        self.assertEquals(self.view.regions, {})
+
+    def test_remove_forgets(self):
+        self.updater.update(self.view, coverage([1, 2], [3]))
+        self.updater.remove(self.view)
+        self.view.changes = []
+
+        self.updater.update(self.view, coverage([1, 2], [3]))
+        self.assertEquals(len(self.view.changes), 3)
+
+
+class ViewportTest(unittest.TestCase):
+
+    def setUp(self):
+        config.loaded = True
+        config.debug = False
+        config.viewport_threshold = 100
+        config.viewport_margin = 5
+        self.view = RecordingView(500)
+        self.updater = ViewUpdater(AppliedCoverage())
+
+    def tearDown(self):
+        config.loaded = False
+        del config.debug
+        del config.viewport_threshold
+        del config.viewport_margin
+
+    def test_viewport(self):
+        # the fake view shows lines 1-61
+        self.assertEquals(
+            self.updater.viewport(self.view, coverage([], [], 500)),
+            (1, 66))
+
+    def test_viewport_small_file(self):
+        self.assertIs(
+            self.updater.viewport(self.view, coverage([], [], 100)), None)
+
+    def test_describe_viewport(self):
+        shown = self.updater.describe(
+            coverage([1, 60, 70, 300], [66, 67], 500), [(1, 66)])
+        self.assertEquals(shown[GOOD], [1, 60])
+        self.assertEquals(shown[BAD], [66])
+        self.assertEquals(shown[STATUS],
+                          'Code coverage: 4/6 lines (66.67%)')
+
+    def test_update_viewport(self):
+        self.updater.update(self.view, coverage([1, 300], [2, 400], 500))
+        self.assertEquals(len(self.view.regions[GOOD]), 1)
+        self.assertEquals(len(self.view.regions[BAD]), 1)
+
+    def test_refresh_inside_viewport(self):
+        self.updater.update(self.view, coverage([1, 300], [2], 500))
+        self.view.changes = []
+        self.updater.refresh(self.view)
+        self.assertEquals(self.view.changes, [])
+
+    def scroll(self, top):
+        self.view.top = top
+        self.view.changes = []
+        self.updater.refresh(self.view)
+        return self.updater.get_applied().get(self.view)
+
+    def test_refresh_grows_viewport(self):
+        self.updater.update(self.view, coverage([1, 200, 400], [], 500))
+
+        shown = self.scroll(300)
+        self.assertEquals(shown[VIEWPORT], [(1, 66), (296, 366)])
+        self.assertEquals(shown[GOOD], [1])
+
+        shown = self.scroll(350)
+        self.assertEquals(shown[VIEWPORT], [(1, 66), (296, 416)])
+        self.assertEquals(shown[GOOD], [1, 400])
+
+    def test_refresh_scroll_back(self):
+        self.updater.update(self.view, coverage([1, 400], [], 500))
+        self.scroll(350)
+
+        # the lines at the top are still annotated
+        self.scroll(0)
+        self.assertEquals(self.view.changes, [])
+
+    def test_viewport_reset_for_new_coverage(self):
+        self.updater.update(self.view, coverage([1, 400], [], 500))
+        self.scroll(350)
+
+        self.updater.update(self.view, coverage([1, 400], [2], 500))
+        shown = self.updater.get_applied().get(self.view)
+        self.assertEquals(shown[VIEWPORT], [(346, 416)])
+        self.assertEquals(shown[GOOD], [400])
+
+    def test_viewport_reset_after_edit(self):
+        shown = coverage([1, 400], [], 500)
+        self.updater.update(self.view, shown)
+        self.scroll(350)
+
+        self.view.count = 1
+        self.updater.update(self.view, shown)
+        shown = self.updater.get_applied().get(self.view)
+        self.assertEquals(shown[VIEWPORT], [(346, 416)])
+
+
+class RunsTest(unittest.TestCase):
+
+    def test_runs(self):
+        self.assertEquals(runs([1, 2, 3, 5, 7, 8]),
+                          [(1, 3), (5, 5), (7, 8)])
+
+    def test_runs_unsorted_duplicates(self):
+        self.assertEquals(runs([8, 2, 3, 2, 1, 7, 3]), [(1, 3), (7, 8)])
+
+    def test_runs_empty(self):
+        self.assertEquals(runs([]), [])
+
+
+class UnionTest(unittest.TestCase):
+
+    def test_union(self):
+        self.assertEquals(union([(10, 20), (1, 5), (15, 30), (6, 8)]),
+                          [(1, 8), (10, 30)])
+
+    def test_union_contained(self):
+        self.assertEquals(union([(1, 50), (10, 20)]), [(1, 50)])
+
+
+class ClipTest(unittest.TestCase):
+
+    def test_clip(self):
+        lines = array.array('i', [1, 3, 5, 7, 9])
+        self.assertEquals(clip(lines, [(1, 3), (7, 20)]).tolist(),
+                          [1, 3, 7, 9])
+
+
+class WithinTest(unittest.TestCase):
+
+    def test_within(self):
+        lines = [1, 3, 5, 7, 9]
+        self.assertEquals(within(lines, 3, 7), [3, 5, 7])
+        self.assertEquals(within(lines, 4, 6), [5])
+        self.assertEquals(within(lines, 10, 20), [])
+        self.assertEquals(within(lines, 0, 100), lines)
+
+
+class AnnotateLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.view = fake.View(100)
+        self.updater = ViewUpdater()
+
+    def annotate(self, lines):
+        self.updater.annotate_lines(
+            view=self.view,
+            name='SublimePHPCoverageGood',
+            lines=lines,
+            scope='markup.inserted',
+            icon='dot',
+        )
+        regions = self.view.regions.get('SublimePHPCoverageGood', [])
+        return [(region.begin(), region.end()) for region in regions]
+
+    def test_region_per_line(self):
+        width = self.view.width
+        self.assertEquals(self.annotate([2, 3, 4]), [
+            (width, width * 2 - 1),
+            (width * 2, width * 3 - 1),
+            (width * 3, width * 4 - 1),
+        ])
+
+    def test_single_line_same_shape(self):
+        # a line on its own has the same region as one in a run
+        run = self.annotate([5, 6])[0]
+        self.assertEquals(self.annotate([5]), [run])
+
+    def test_no_lines(self):
+        self.assertEquals(self.annotate([]), [])
+        self.assertEquals(self.view.calls, 0)
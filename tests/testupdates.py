@@ -0,0 +1,79 @@
+import os
+import sys
+import unittest
+
+from php_coverage.updates import ACTIVE, HIDDEN, VISIBLE, UpdateQueue
+
+if sys.version_info >= (3, 3):
+    from unittest.mock import Mock, MagicMock
+else:
+    path = os.path.abspath(os.path.dirname(__file__))
+    sys.path.append(os.path.join(path, '..', 'dist'))
+    from mock import Mock, MagicMock
+
+
+class UpdateQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.priorities = {}
+        self.set_timeout = MagicMock()
+        self.queue = UpdateQueue(
+            self.set_timeout,
+            lambda view: self.priorities.get(view.id(), HIDDEN),
+        )
+        self.applied = []
+
+    def view(self, id, priority=HIDDEN):
+        view = Mock()
+        view.id = MagicMock(return_value=id)
+        self.priorities[id] = priority
+        return view
+
+    def update(self, name):
+        return lambda: self.applied.append(name)
+
+    def test_add_schedules_once(self):
+        self.queue.add(self.view(1), self.update('a'))
+        self.queue.add(self.view(2), self.update('b'))
+        self.set_timeout.assert_called_once_with(self.queue.flush, 1)
+
+    def test_flush(self):
+        self.queue.add(self.view(1), self.update('a'))
+        self.queue.add(self.view(2), self.update('b'))
+        self.queue.flush()
+        self.assertEquals(self.applied, ['a', 'b'])
+        self.assertEquals(len(self.queue.pending), 0)
+
+        self.queue.add(self.view(1), self.update('c'))
+        self.assertEquals(self.set_timeout.call_count, 2)
+
+    def test_flush_latest_only(self):
+        self.queue.add(self.view(1), self.update('old'))
+        self.queue.add(self.view(1), self.update('new'))
+        self.queue.flush()
+        self.assertEquals(self.applied, ['new'])
+
+    def test_flush_priority(self):
+        self.queue.add(self.view(1, HIDDEN), self.update('hidden'))
+        self.queue.add(self.view(2, VISIBLE), self.update('visible'))
+        self.queue.add(self.view(3, ACTIVE), self.update('active'))
+        self.queue.add(self.view(4, VISIBLE), self.update('visible2'))
+        self.queue.flush()
+        self.assertEquals(
+            self.applied, ['active', 'visible', 'visible2', 'hidden'])
+
+    def test_flush_error(self):
+        self.queue.add(self.view(1), lambda: 1 / 0)
+        self.queue.add(self.view(2), self.update('b'))
+        self.queue.flush()
+        self.assertEquals(self.applied, ['b'])
+
+    def test_discard(self):
+        view = self.view(1)
+        self.queue.add(view, self.update('a'))
+        self.queue.discard(view)
+        self.queue.flush()
+        self.assertEquals(self.applied, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,15 @@
 import os
+import shutil
 import sys
+import tempfile
 import threading
 import unittest
 
-from php_coverage.watcher import CoverageWatcher, FileWatcher
+from php_coverage.config import config
+from php_coverage.data import LoadCancelled, fingerprint
+from php_coverage.watcher import CoverageWatcher, FileWatcher, SAMPLE_SIZE
+from php_coverage.watcher import ShardedCoverageWatcher
+from php_coverage.watcher import get_scheduler, stop_scheduler
 
 if sys.version_info >= (3, 3):
     from unittest.mock import Mock, MagicMock
@@ -26,6 +32,7 @@ class TestFileWatcher(unittest.TestCase):
             os.mkdir(dir)
         self.file = os.path.join(dir, 'test.txt')
         self.watcher = FileWatcher(self.file)
+        self.watcher.settle_time = 0
         self.detected = threading.Event()
         self.delete()
 
@@ -62,6 +69,15 @@ class TestFileWatcher(unittest.TestCase):
         self.modify('unchanged')
         self.assertTrue(self.detected.wait(1))
 
+    def test_settle(self):
+        self.watcher.settle_time = 0.5
+        self.watcher.add_callback(MODIFIED, 1, lambda: self.detected.set())
+        self.create('settle1')
+        self.watcher.start()
+        self.modify('settle2')
+        self.assertFalse(self.detected.wait(0.3))
+        self.assertTrue(self.detected.wait(1))
+
     def create(self, content):
         if not os.path.exists(os.path.dirname(self.file)):
             os.mkdir(os.path.dirname(self.file))
@@ -82,6 +98,113 @@ class TestFileWatcher(unittest.TestCase):
             os.remove(self.file)
 
 
+class TestFileWatcherDigest(unittest.TestCase):
+
+    def setUp(self):
+        dir = os.path.join(os.path.dirname(__file__), 'watcher')
+        if not os.path.exists(dir):
+            os.mkdir(dir)
+        self.file = os.path.join(dir, 'digest.txt')
+        self.watcher = FileWatcher(self.file)
+
+    def tearDown(self):
+        if os.path.exists(self.file):
+            os.remove(self.file)
+
+    def test_sample(self):
+        self.create('a' * SAMPLE_SIZE * 4)
+        sample = self.watcher.sample(fingerprint(self.file))
+
+        # a change between the sampled blocks isn't noticed
+        self.create('a' * SAMPLE_SIZE + 'b' + 'a' * (SAMPLE_SIZE * 3 - 1))
+        self.assertEquals(self.watcher.sample(fingerprint(self.file)), sample)
+
+        # but a change in the last block is
+        self.create('a' * (SAMPLE_SIZE * 4 - 1) + 'b')
+        self.assertNotEquals(
+            self.watcher.sample(fingerprint(self.file)), sample)
+
+    def test_digest_full_hash(self):
+        self.watcher.full_hash = True
+        self.create('a' * SAMPLE_SIZE * 4)
+        digest = self.watcher.digest(fingerprint(self.file))
+
+        self.create('a' * SAMPLE_SIZE + 'b' + 'a' * (SAMPLE_SIZE * 3 - 1))
+        self.assertNotEquals(
+            self.watcher.digest(fingerprint(self.file)), digest)
+
+    def test_digest_nonexistent(self):
+        self.assertIs(self.watcher.digest(fingerprint(self.file)), None)
+
+    def test_poll_activity(self):
+        self.watcher.settle_time = 0
+        self.watcher.reset()
+        self.assertFalse(self.watcher.poll())
+        self.create('created')
+        self.assertTrue(self.watcher.poll())
+        self.assertFalse(self.watcher.poll())
+
+    def create(self, content):
+        with open(self.file, 'w') as file:
+            file.write(content)
+
+
+class TestPollingFileWatcher(TestFileWatcher):
+
+    def setUp(self):
+        config.loaded = True
+        config.debug = False
+        config.watch_backend = 'polling'
+        stop_scheduler(1)
+        super(TestPollingFileWatcher, self).setUp()
+
+    def tearDown(self):
+        super(TestPollingFileWatcher, self).tearDown()
+        self.assertIs(get_scheduler().backend, None)
+        stop_scheduler(1)
+        config.loaded = False
+        del config.debug
+        del config.watch_backend
+
+
+class TestWatcherScheduler(unittest.TestCase):
+
+    def setUp(self):
+        dir = os.path.join(os.path.dirname(__file__), 'watcher')
+        if not os.path.exists(dir):
+            os.mkdir(dir)
+        self.watchers = [
+            FileWatcher(os.path.join(dir, 'test%d.txt' % i))
+            for i in range(20)
+        ]
+
+    def tearDown(self):
+        for watcher in self.watchers:
+            watcher.stop()
+
+    def test_single_thread(self):
+        before = threading.active_count()
+        for watcher in self.watchers:
+            watcher.start()
+        self.assertTrue(threading.active_count() <= before + 1)
+        self.assertEquals(len(get_scheduler().watchers), 20)
+
+    def test_tick_reset_on_add(self):
+        scheduler = get_scheduler()
+        scheduler.interval = scheduler.get_max_tick()
+        self.watchers[0].start()
+        self.assertTrue(scheduler.tick() < scheduler.get_max_tick())
+
+    def test_stop(self):
+        for watcher in self.watchers:
+            watcher.start()
+        for watcher in self.watchers:
+            watcher.stop()
+            self.assertFalse(watcher.is_alive())
+        self.assertEquals(get_scheduler().watchers, [])
+        self.assertTrue(get_scheduler().is_alive())
+
+
 class TestCoverageWatcher(TestFileWatcher):
 
     def setUp(self):
@@ -92,6 +215,7 @@ class TestCoverageWatcher(TestFileWatcher):
         factory.factory = MagicMock(return_value='return')
 
         self.watcher = CoverageWatcher(self.file, factory)
+        self.watcher.settle_time = 0
         self.detected = threading.Event()
         self.delete()
 
@@ -127,7 +251,189 @@ class TestCoverageWatcher(TestFileWatcher):
         self.modify('unchanged')
         self.assertTrue(self.detected.wait(1))
 
+    def test_settle(self):
+        self.watcher.settle_time = 0.5
+        self.watcher.add_callback(MODIFIED, 1, lambda x: self.detect(x))
+        self.create('settle1')
+        self.watcher.start()
+        self.modify('settle2')
+        self.assertFalse(self.detected.wait(0.3))
+        self.assertTrue(self.detected.wait(1))
+
+    def test_settle_complete(self):
+        self.watcher.settle_time = 5
+        self.watcher.add_callback(MODIFIED, 1, lambda x: self.detect(x))
+        self.create('<coverage>\n</coverage>')
+        self.watcher.start()
+        self.modify('<coverage>\n</coverage>\n')
+        self.assertTrue(self.detected.wait(1))
+
     def detect(self, data):
         "Perform callback parameter assertions and set detected event"
         self.assertEquals(data, 'return')
         self.detected.set()
+
+
+class TestCoverageWatcherSources(unittest.TestCase):
+
+    def setUp(self):
+        self.data = Mock()
+        self.data.reuse = MagicMock(return_value=True)
+
+        factory = Mock()
+        factory.factory = MagicMock(return_value=self.data)
+
+        self.watcher = CoverageWatcher('/path/to/coverage.xml', factory)
+        self.callback = MagicMock()
+        self.watcher.add_callback(MODIFIED, 1, self.callback, '/file.php')
+
+    def test_dispatch_doesnt_compare(self):
+        self.watcher.dispatch(MODIFIED)
+        self.assertFalse(self.data.reuse.called)
+        self.callback.assert_called_once_with(self.data)
+
+    def test_changed_first(self):
+        self.assertTrue(self.watcher.changed(1, self.data))
+        self.assertFalse(self.data.reuse.called)
+        self.assertIs(self.watcher.delivered[1], self.data)
+
+    def test_unchanged_source(self):
+        previous = Mock()
+        self.watcher.changed(1, previous)
+        self.assertFalse(self.watcher.changed(1, self.data))
+        self.data.reuse.assert_called_once_with(previous, '/file.php')
+        self.assertIs(self.watcher.delivered[1], self.data)
+
+    def test_changed_source(self):
+        self.data.reuse.return_value = False
+        self.watcher.changed(1, Mock())
+        self.assertTrue(self.watcher.changed(1, self.data))
+
+    def test_no_source(self):
+        self.watcher.changed(2, Mock())
+        self.assertTrue(self.watcher.changed(2, self.data))
+        self.assertFalse(self.data.reuse.called)
+
+    def test_remove_callback(self):
+        self.watcher.changed(1, self.data)
+        self.watcher.remove_callback(1)
+        self.assertEquals(self.watcher.sources, {})
+        self.assertEquals(self.watcher.delivered, {})
+
+    def test_cancelled(self):
+        previous = Mock()
+        self.watcher.changed(1, previous)
+        self.data.reuse.side_effect = LoadCancelled()
+        self.assertRaises(
+            LoadCancelled, self.watcher.changed, 1, self.data)
+        self.assertIs(self.watcher.delivered[1], previous)
+
+    def test_failing_callback(self):
+        self.callback.side_effect = ValueError()
+        self.watcher.add_callback(CREATED, 1, self.callback)
+        self.watcher.last_state = None
+        self.watcher.settle_time = 0
+        self.watcher.filename = __file__
+        self.assertRaises(ValueError, self.watcher.poll)
+        self.assertIsNotNone(self.watcher.last_state)
+        self.assertFalse(self.watcher.poll())
+
+
+class TestShardedCoverageWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.pattern = os.path.join(self.dir, 'clover-*.xml')
+
+        factory = Mock()
+        factory.factory = MagicMock(return_value='return')
+
+        self.watcher = ShardedCoverageWatcher(self.pattern, factory)
+        self.watcher.settle_time = 0
+        self.events = []
+
+        for event in (CREATED, DELETED, MODIFIED, UNCHANGED):
+            self.watcher.add_callback(
+                event, event, lambda x, event=event: self.events.append(event))
+
+    def shard(self, name, content, mtime=None):
+        filename = os.path.join(self.dir, 'clover-%s.xml' % name)
+        with open(filename, 'w') as f:
+            f.write(content)
+
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+
+        return filename
+
+    def test_reset(self):
+        self.shard('1', 'one')
+        self.shard('2', 'two')
+        self.watcher.reset()
+        self.assertEquals(len(self.watcher.shards), 2)
+        self.assertFalse(self.watcher.poll())
+        self.assertEquals(self.events, [])
+
+    def test_created(self):
+        self.watcher.reset()
+        self.shard('1', 'one')
+        self.assertTrue(self.watcher.poll())
+        self.assertEquals(self.events, [CREATED])
+        self.watcher.get_coverage_factory().factory.assert_called_once_with(
+            self.pattern)
+
+    def test_new_shard(self):
+        self.shard('1', 'one')
+        self.watcher.reset()
+        self.shard('2', 'two')
+        self.assertTrue(self.watcher.poll())
+        self.assertEquals(self.events, [MODIFIED])
+
+    def test_modified_shard(self):
+        self.shard('1', 'one')
+        self.shard('2', 'two')
+        self.watcher.reset()
+        self.shard('2', 'changed', 1000000000)
+        self.assertTrue(self.watcher.poll())
+        self.assertEquals(self.events, [MODIFIED])
+        self.assertFalse(self.watcher.poll())
+        self.assertEquals(self.events, [MODIFIED])
+
+    def test_unchanged_shard(self):
+        self.shard('1', 'one')
+        self.watcher.reset()
+        self.shard('1', 'one', 1000000000)
+        self.assertTrue(self.watcher.poll())
+        self.assertEquals(self.events, [UNCHANGED])
+
+    def test_deleted_shard(self):
+        first = self.shard('1', 'one')
+        second = self.shard('2', 'two')
+        self.watcher.reset()
+
+        os.remove(second)
+        self.assertTrue(self.watcher.poll())
+        self.assertEquals(self.events, [MODIFIED])
+        self.assertEquals(list(self.watcher.shards), [first])
+
+        os.remove(first)
+        self.assertTrue(self.watcher.poll())
+        self.assertEquals(self.events, [MODIFIED, DELETED])
+        self.assertEquals(self.watcher.shards, {})
+
+    def test_settle(self):
+        self.shard('1', 'one')
+        self.watcher.reset()
+        self.watcher.settle_time = 60
+        self.shard('2', 'two')
+        self.assertTrue(self.watcher.poll())
+        self.assertIsNotNone(self.watcher.settling)
+        self.assertEquals(self.events, [])
+
+        # a complete shard doesn't need to settle
+        self.shard('2', '<coverage>\n</coverage>')
+        self.assertTrue(self.watcher.poll())
+        self.assertIsNone(self.watcher.settling)
+        self.assertEquals(self.events, [MODIFIED])
+
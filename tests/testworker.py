@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import unittest
+
+from php_coverage import worker
+
+if sys.version_info >= (3, 3):
+    from unittest.mock import patch
+else:
+    path = os.path.abspath(os.path.dirname(__file__))
+    sys.path.append(os.path.join(path, '..', 'dist'))
+    from mock import patch
+
+
+def fail():
+    raise ValueError("failed")
+
+
+def sleep():
+    time.sleep(2)
+
+
+@unittest.skipUnless(worker.available(), "requires forked workers")
+class WorkerTest(unittest.TestCase):
+
+    def tearDown(self):
+        worker.shutdown()
+
+    def test_run(self):
+        self.assertNotEquals(worker.run(os.getpid), os.getpid())
+
+    def test_run_shared_executor(self):
+        self.assertEquals(worker.run(os.getpid), worker.run(os.getpid))
+
+    def test_run_raises(self):
+        self.assertRaises(ValueError, worker.run, fail)
+
+    def test_shutdown(self):
+        pid = worker.run(os.getpid)
+        worker.shutdown()
+        self.assertIs(worker.executor, None)
+        self.assertNotEquals(worker.run(os.getpid), pid)
+
+    def test_run_timeout(self):
+        worker.run(os.getpid)
+        processes = list(worker.executor._processes.values())
+
+        with patch.object(worker, 'TIMEOUT', 0.1):
+            self.assertRaises(worker.WorkerUnavailable, worker.run, sleep)
+        self.assertIs(worker.executor, None)
+        self.assertFalse(any(process.is_alive() for process in processes))
+
+    def test_shutdown_busy(self):
+        pool = worker.get_executor()
+        future = pool.submit(sleep)
+        processes = list(pool._processes.values())
+
+        start = time.time()
+        worker.shutdown()
+        self.assertLess(time.time() - start, 1)
+        self.assertFalse(any(process.is_alive() for process in processes))
+        self.assertTrue(future.done())
+
+    def test_unavailable_without_fork(self):
+        with patch('multiprocessing.get_all_start_methods',
+                   return_value=['spawn']):
+            self.assertFalse(worker.available())
+            self.assertRaises(
+                worker.WorkerUnavailable, worker.run, os.getpid)
+
+    def test_unavailable_on_windows(self):
+        with patch('os.name', 'nt'):
+            self.assertIs(worker.get_context(), None)
+
+if __name__ == '__main__':
+    unittest.main()